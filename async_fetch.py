@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import httpx
+from concurrency import AIMDController
+from instrumentation import increment, span
+from models import ModelError
+from nerdgraph_client import BaseNerdGraphClient, NerdGraphError
+
+
+class AsyncNerdGraphClient(BaseNerdGraphClient):
+	"""
+	asyncio counterpart of NerdGraphClient. All cursor chains share one HTTP client,
+	and the requests outstanding across all of them are limited by an AIMDController:
+	the one passed as concurrency, or one adapting between min_in_flight and max_in_flight.
+	"""
+	def __init__(self, api_key, max_in_flight=4, min_in_flight=1, **kwargs):
+		super().__init__(api_key, **kwargs)
+		if self.concurrency is None:
+			self.concurrency = AIMDController('nerdgraph', max_in_flight, min_in_flight)
+		max_in_flight = self.concurrency.maximum
+		self.max_in_flight = max_in_flight
+		self.client = httpx.AsyncClient(
+			headers=self.headers,
+			timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+			limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+		)
+
+	async def execute(self, query, account_id=None, cursor=None, partial=False):
+		"""
+		Post a GraphQL query and return the decoded response body, retrying like NerdGraphClient.execute.
+		The in-flight slot is only held for the request itself, not while backing off.
+		"""
+		key, data = self.cache_lookup(query, account_id, cursor)
+		if data is not None:
+			return data
+		attempt = 0
+		while True:
+			retry_after = None
+			try:
+				increment('nerdgraph_requests')
+				async with self.concurrency.async_slot() as slot:
+					with span('nerdgraph_request'):
+						response = await self.client.post(self.base_url, json={'query': query})
+					increment('nerdgraph_bytes_received', len(response.content))
+					data, error, retry_after = self.check_response(response.status_code, response.headers, response.json, partial)
+					slot.outcome = self.request_outcome(response.status_code, error)
+				if data is not None:
+					self.cache_store(key, data)
+					return data
+			except (httpx.TransportError, httpx.TimeoutException) as e:
+				error = str(e) or type(e).__name__
+			await asyncio.sleep(self.next_retry(attempt, error, retry_after))
+			attempt += 1
+
+	async def aclose(self):
+		await self.client.aclose()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.aclose()
+
+
+async def iter_pages_async(resource_handler, client, cursor=None):
+	"""
+	Async form of NewRelicResource.iter_pages, yielding (entities, next_cursor) per page.
+	"""
+	while True:
+		with span('page_fetch', resource_type=resource_handler.resource_type):
+			data = await client.execute(resource_handler.build_query(cursor), resource_handler.account_id, cursor)
+			cursor = resource_handler.get_next_cursor(data)
+			entities = resource_handler.extract_entities(data)
+		increment('pages_fetched', resource_type=resource_handler.resource_type)
+		increment('entities_fetched', len(entities), resource_type=resource_handler.resource_type)
+		yield entities, cursor
+		if not cursor:
+			return
+
+
+async def fetch_chain(resource_handler, client, cursor=None, on_page=None):
+	entities_to_process = []
+	async for entities, next_cursor in iter_pages_async(resource_handler, client, cursor):
+		if on_page is not None:
+			on_page(resource_handler, entities, next_cursor)
+		entities_to_process.extend(entities)
+	logging.info(f'Fetched {len(entities_to_process)} resources of type {resource_handler.resource_type}')
+	return entities_to_process
+
+
+async def fetch_all_async(resource_handlers, client, cursors=None, on_page=None):
+	"""
+	Walk the cursor chains of all handlers concurrently over one client, each from
+	cursors[resource_type] when given. on_page is called with the handler, entities
+	and next cursor of every page.
+	Returns a dict of resource_type -> list of entities, or the exception that stopped the chain.
+	"""
+	cursors = cursors or {}
+	results = await asyncio.gather(
+		*(fetch_chain(resource_handler, client, cursors.get(resource_handler.resource_type), on_page)
+			for resource_handler in resource_handlers),
+		return_exceptions=True
+	)
+	return {resource_handler.resource_type: result for resource_handler, result in zip(resource_handlers, results)}
+
+
+def fetch_all(resource_handlers, api_key, max_in_flight=4, cursors=None, on_page=None, min_in_flight=1, **client_options):
+	"""
+	Fetch every handler's resources concurrently, see fetch_all_async.
+	"""
+	async def run():
+		async with AsyncNerdGraphClient(api_key, max_in_flight=max_in_flight, min_in_flight=min_in_flight,
+				**client_options) as client:
+			return await fetch_all_async(resource_handlers, client, cursors, on_page)
+	return asyncio.run(run())
+
+
+def is_fetch_error(result):
+	# ValueError: a response that is not JSON, e.g. the HTML error page of a proxy
+	return isinstance(result, (httpx.HTTPError, NerdGraphError, KeyError, ModelError, ValueError))
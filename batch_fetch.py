@@ -0,0 +1,113 @@
+import logging
+import re
+from instrumentation import increment, span
+from models import ModelError
+from nerdgraph_client import NerdGraphError
+
+
+ACCOUNT_BLOCK = re.compile(r'\baccount(?:_id)?\(id:\s*[^)]*\)\s*\{')
+
+
+def account_selection(resource_handler, cursor=None):
+	"""
+	Returns the selection inside the account block of the handler's query, the part
+	that is repeated under one alias per account in a batched query.
+	"""
+	query = resource_handler.build_query(cursor)
+	match = ACCOUNT_BLOCK.search(query)
+	if match is None:
+		raise ValueError(f'No account block in the {resource_handler.resource_type} query')
+	depth = 1
+	for end in range(match.end(), len(query)):
+		if query[end] == '{':
+			depth += 1
+		elif query[end] == '}':
+			depth -= 1
+			if depth == 0:
+				return query[match.end():end]
+	raise ValueError(f'Unbalanced account block in the {resource_handler.resource_type} query')
+
+
+def build_batch_query(resource_handlers, cursors):
+	"""
+	Build one query fetching the page at cursors[account_id] for every handler, each
+	account under its own alias (a0: account(id: ...) { ... }).
+	Returns the query and a dict of alias -> account_id.
+	"""
+	aliases = {}
+	blocks = []
+	for index, (account_id, resource_handler) in enumerate(resource_handlers.items()):
+		alias = f'a{index}'
+		aliases[alias] = account_id
+		blocks.append(f'{alias}: account(id: {account_id}) {{{account_selection(resource_handler, cursors.get(account_id))}}}')
+	return '{\n  actor {\n    ' + '\n    '.join(blocks) + '\n  }\n}', aliases
+
+
+def _errors_by_alias(errors, aliases):
+	"""
+	Group GraphQL errors by the alias in their path. Errors that can not be tied to
+	an account fail the whole batch.
+	"""
+	by_alias = {}
+	for error in errors:
+		path = error.get('path') or []
+		if len(path) < 2 or path[0] != 'actor' or path[1] not in aliases:
+			raise NerdGraphError(f'NerdGraph returned errors: {errors}', errors)
+		by_alias.setdefault(path[1], []).append(error)
+	return by_alias
+
+
+def fetch_accounts(resource_handlers, client, batch_size=10):
+	"""
+	Walk the cursor chains of several accounts together, fetching the next page of up
+	to batch_size accounts per request. An account drops out of the batch once its
+	nextCursor runs dry, or when NerdGraph returns errors for it.
+	`resource_handlers` maps account_id -> handler, all of the same resource type.
+	Returns a dict of account_id -> list of entities, or the exception that stopped that account.
+	"""
+	results = {account_id: [] for account_id in resource_handlers}
+	# account_id -> cursor of the next page, None for the first one
+	pending = {account_id: None for account_id in resource_handlers}
+	resource_type = next(iter(resource_handlers.values())).resource_type if resource_handlers else None
+	while pending:
+		batch = {account_id: resource_handlers[account_id] for account_id in list(pending)[:batch_size]}
+		query, aliases = build_batch_query(batch, pending)
+		try:
+			with span('batch_fetch', resource_type=resource_type):
+				data = client.execute(query, ','.join(batch), None, partial=True)
+			errors = _errors_by_alias(data.get('errors') or [], aliases)
+		except NerdGraphError as e:
+			# Without a usable response no account in the batch can make progress
+			for account_id in batch:
+				results[account_id] = e
+				del pending[account_id]
+			continue
+		increment('batched_requests', resource_type=resource_type)
+
+		for alias, account_id in aliases.items():
+			resource_handler = batch[account_id]
+			account = (data.get('data') or {}).get('actor', {}).get(alias)
+			if alias in errors or account is None:
+				results[account_id] = NerdGraphError(
+					f'NerdGraph returned errors for account {account_id}: {errors.get(alias)}', errors.get(alias))
+				del pending[account_id]
+				continue
+			# Handlers parse responses shaped like a single account query
+			page = {'data': {'actor': {'account': account}}}
+			try:
+				cursor = resource_handler.get_next_cursor(page)
+				entities = resource_handler.extract_entities(page)
+			except (KeyError, TypeError, ModelError) as e:
+				results[account_id] = e
+				del pending[account_id]
+				continue
+			increment('pages_fetched', resource_type=resource_type)
+			increment('entities_fetched', len(entities), resource_type=resource_type)
+			results[account_id].extend(entities)
+			if cursor:
+				pending[account_id] = cursor
+			else:
+				del pending[account_id]
+				logging.info(f'Fetched {len(results[account_id])} resources of type {resource_type} '
+					f'from account {account_id}')
+	return results
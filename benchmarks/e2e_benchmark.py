@@ -0,0 +1,175 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from channel_resource import ChannelResource
+from condition_resource import ConditionResource
+from destination_resource import DestinationResource
+from mock_nerdgraph import (MockNerdGraph, add_server_arguments, start_server, synthetic_channel,
+	synthetic_condition, synthetic_destination)
+from nerdgraph_client import NerdGraphClient
+
+
+STAGES = ['fetch', 'render', 'import']
+
+# resource type -> (handler class, mock server collection, synthetic entity factory)
+RESOURCE_KINDS = {
+	'newrelic_nrql_alert_condition': (ConditionResource, 'conditions', synthetic_condition),
+	'newrelic_notification_channel': (ChannelResource, 'channels', synthetic_channel),
+	'newrelic_notification_destination': (DestinationResource, 'destinations', synthetic_destination)
+}
+
+
+def peak_rss_mb():
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, macOS bytes
+	return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_stage(args):
+	"""
+	Run one stage in this process and print its result as JSON. Every stage runs in a
+	fresh process so its peak RSS is not hidden by an earlier, bigger stage.
+	"""
+	handler_class, _, factory = RESOURCE_KINDS[args.resource_type]
+	client = NerdGraphClient('', base_url=args.url, backoff_factor=0.05, max_backoff=1)
+	handler = handler_class(args.resource_type, '1', '', client=client)
+	os.chdir(args.workdir)
+
+	if args.stage == 'fetch':
+		start = time.perf_counter()
+		entities = list(handler.iter_resources())
+		elapsed = time.perf_counter() - start
+	else:
+		entities = [handler.parse_entity(factory(i)) for i in range(args.size)]
+		if args.stage == 'render':
+			start = time.perf_counter()
+			handler.create_terraform_config(entities)
+			elapsed = time.perf_counter() - start
+		else:
+			handler.create_terraform_config(entities)
+			start = time.perf_counter()
+			if args.import_mode == 'bulk':
+				failures = handler.bulk_import_to_terraform(entities)
+			else:
+				failures = handler.import_to_terraform(entities)
+			elapsed = time.perf_counter() - start
+			if failures:
+				sys.exit(f'{len(failures)} imports failed')
+
+	print(json.dumps({
+		'stage': args.stage,
+		'resource_type': args.resource_type,
+		'entities': len(entities),
+		'seconds': elapsed,
+		'entities_per_second': len(entities) / elapsed if elapsed else None,
+		'peak_rss_mb': peak_rss_mb()
+	}))
+
+
+def run_suite(args):
+	nerdgraph = MockNerdGraph(page_size=args.page_size, latency=args.latency, rate_limit_rate=args.rate_limit_rate,
+		retry_after=args.retry_after, max_concurrent=args.max_concurrent)
+	server, url = start_server(nerdgraph)
+	_, collection, _ = RESOURCE_KINDS[args.resource_type]
+	# The fake terraform binary shadows a real one for the import stage
+	env = dict(os.environ, PATH=os.path.join(BENCHMARK_DIR, 'bin') + os.pathsep + os.environ.get('PATH', ''))
+
+	results = []
+	print(f"{'stage':<8}{'entities':>10}{'seconds':>10}{'entities/s':>14}{'peak RSS MB':>14}")
+	try:
+		for size in args.sizes:
+			nerdgraph.sizes[collection] = size
+			for stage in args.stages:
+				with tempfile.TemporaryDirectory() as workdir:
+					command = [sys.executable, os.path.abspath(__file__), '--run-stage', stage, '--size', str(size),
+						'--url', url, '--workdir', workdir, '--resource-type', args.resource_type,
+						'--import-mode', args.import_mode]
+					completed = subprocess.run(command, env=env, capture_output=True, text=True)
+				if completed.returncode != 0:
+					sys.exit(f'{stage} stage with {size} entities failed:\n{completed.stderr}')
+				result = json.loads(completed.stdout.strip().splitlines()[-1])
+				result['size'] = size
+				results.append(result)
+				print(f"{stage:<8}{result['entities']:>10}{result['seconds']:>10.3f}"
+					f"{result['entities_per_second'] or 0:>14,.0f}{result['peak_rss_mb']:>14.1f}")
+	finally:
+		server.shutdown()
+	if args.rate_limit_rate:
+		print(f'mock server answered {nerdgraph.rate_limited} of {nerdgraph.requests} requests with 429')
+	return results
+
+
+def find_regressions(results, baseline, max_regression):
+	"""
+	Returns a message for every stage and size that got slower or bigger than the baseline
+	allows. Results without a baseline counterpart are not compared.
+	"""
+	previous = {(r['stage'], r['resource_type'], r['size']): r for r in baseline}
+	regressions = []
+	for result in results:
+		old = previous.get((result['stage'], result['resource_type'], result['size']))
+		if old is None:
+			continue
+		label = f"{result['stage']} at {result['size']} entities"
+		if result['entities_per_second'] < old['entities_per_second'] * (1 - max_regression):
+			regressions.append(f"{label}: {result['entities_per_second']:,.0f} entities/s, "
+				f"baseline {old['entities_per_second']:,.0f}")
+		if result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + max_regression):
+			regressions.append(f"{label}: peak RSS {result['peak_rss_mb']:.1f} MB, baseline {old['peak_rss_mb']:.1f} MB")
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Measure fetch, render and import throughput and peak RSS against a mock NerdGraph and a fake terraform.')
+	parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')], default=[1000, 10000, 100000],
+		help='Comma separated entity counts')
+	parser.add_argument('--stages', type=lambda value: value.split(','), default=STAGES, help='Comma separated stages to run')
+	parser.add_argument('--resource-type', choices=list(RESOURCE_KINDS), default='newrelic_nrql_alert_condition')
+	parser.add_argument('--import-mode', choices=['bulk', 'per-resource'], default='bulk',
+		help='per-resource starts one terraform process per entity, keep the sizes small')
+	parser.add_argument('--output', help='Write the results to this JSON file')
+	parser.add_argument('--baseline', help='Fail when results regress against this earlier --output file')
+	parser.add_argument('--max-regression', type=float, default=0.2,
+		help='Allowed throughput drop and peak RSS growth against the baseline, as a fraction')
+	add_server_arguments(parser)
+	# Used by the suite to run a single stage in a child process
+	parser.add_argument('--run-stage', choices=STAGES, dest='stage', help=argparse.SUPPRESS)
+	parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+	parser.add_argument('--url', help=argparse.SUPPRESS)
+	parser.add_argument('--workdir', help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.WARNING)
+	if args.stage:
+		run_stage(args)
+		return
+
+	for stage in args.stages:
+		if stage not in STAGES:
+			parser.error(f'unknown stage {stage}, expected one of {", ".join(STAGES)}')
+	results = run_suite(args)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=4)
+	if args.baseline:
+		with open(args.baseline) as f:
+			regressions = find_regressions(results, json.load(f), args.max_regression)
+		for regression in regressions:
+			print(f'REGRESSION {regression}')
+		if regressions:
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,269 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CURSOR_PATTERN = re.compile(r'cursor:\s*"([^"]*)"')
+# An account block, optionally aliased as in `a0: account(id: 1) {`
+ACCOUNT_PATTERN = re.compile(r'(?:(\w+):\s*)?\baccount(?:_id)?\(id:\s*[^)]*\)\s*\{')
+# updatedAt of every synthetic entity until it is edited, epoch milliseconds
+CREATED_AT = 1700000000000
+
+
+def synthetic_condition(i):
+	return {
+		'id': str(100000 + i),
+		'name': f'Service {i % 500} error rate {i}',
+		'policyId': str(9000 + i % 250),
+		'nrql': {'query': f"SELECT percentage(count(*), WHERE error IS true) FROM Transaction WHERE appName = 'svc-{i % 500}'"},
+		'terms': [
+			{'operator': 'ABOVE', 'priority': 'CRITICAL', 'threshold': 5.0, 'thresholdDuration': 300, 'thresholdOccurrences': 'ALL'},
+			{'operator': 'ABOVE', 'priority': 'WARNING', 'threshold': 2.5, 'thresholdDuration': 300, 'thresholdOccurrences': 'ALL'}
+		],
+		'signal': {
+			'slideBy': None,
+			'fillOption': 'STATIC' if i % 3 == 0 else 'NONE',
+			'aggregationMethod': 'EVENT_FLOW',
+			'aggregationDelay': 120,
+			'aggregationWindow': 60,
+			'aggregationTimer': None,
+			'evaluationDelay': None,
+			'fillValue': 0.0 if i % 3 else 1.0
+		},
+		'expiration': {
+			'closeViolationsOnExpiration': bool(i % 2),
+			'expirationDuration': 600,
+			'ignoreOnExpectedTermination': False,
+			'openViolationOnExpiration': False
+		},
+		'enabled': bool(i % 5),
+		'runbookUrl': f'https://runbooks.example.com/svc-{i % 500}' if i % 4 else None,
+		'type': 'STATIC',
+		'violationTimeLimitSeconds': 86400,
+		'description': 'Error rate above threshold\nfor the "prod" service' if i % 5 else None,
+		'titleTemplate': None,
+		'updatedAt': CREATED_AT
+	}
+
+
+def synthetic_channel(i):
+	return {
+		'id': f'channel-{i:08d}',
+		'name': f'Team {i % 100} alerts {i}',
+		'type': 'SLACK' if i % 2 else 'EMAIL',
+		'destinationId': f'destination-{i % 1000:08d}',
+		'product': 'IINT',
+		'properties': [
+			{'key': 'channelId', 'label': None, 'value': f'C{i:08d}', 'displayValue': None},
+			{'key': 'customDetailsSlack', 'label': 'Details', 'value': 'Condition: {{ conditionName }}\nState: {{ state }}', 'displayValue': None}
+		],
+		'status': 'DEFAULT',
+		'updatedAt': CREATED_AT
+	}
+
+
+def synthetic_destination(i):
+	return {
+		'id': f'destination-{i:08d}',
+		'name': f'Team {i % 100} destination {i}',
+		'type': 'EMAIL',
+		'properties': [{'key': 'email', 'value': f'team-{i % 100}@example.com', 'displayValue': None}],
+		'auth': None,
+		'updatedAt': CREATED_AT
+	}
+
+
+def synthetic_policy(i):
+	# Matches the policyId of the synthetic conditions
+	return {
+		'id': str(9000 + i),
+		'name': f'Service policy {i}',
+		'incidentPreference': 'PER_CONDITION' if i % 2 else 'PER_POLICY'
+	}
+
+
+class MockNerdGraph:
+	"""
+	In-memory stand-in for the parts of NerdGraph the resource handlers query.
+	Entities are generated on demand from their index, so even very large accounts
+	cost no memory on the server side. Cursors are page offsets.
+	"""
+	def __init__(self, conditions=1000, channels=1000, destinations=1000, page_size=200, latency=0.0,
+			rate_limit_rate=0.0, retry_after=0, seed=0, policies=250, max_concurrent=0):
+		self.sizes = {'conditions': conditions, 'channels': channels, 'destinations': destinations, 'policies': policies}
+		self.page_size = page_size
+		self.latency = latency
+		self.rate_limit_rate = rate_limit_rate
+		self.retry_after = retry_after
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.requests = 0
+		self.rate_limited = 0
+		# Requests answered with 429 while more than max_concurrent are in flight, 0 for no limit
+		self.max_concurrent = max_concurrent
+		self.active = 0
+		self.peak_active = 0
+		# kind -> {index: fields}, changes made with edit() on top of the synthetic entities
+		self.edits = {}
+
+	def edit(self, kind, index, **fields):
+		"""
+		Change fields of one entity, like an edit in the New Relic UI, e.g. to test drift detection.
+		"""
+		with self.lock:
+			entity_edits = self.edits.setdefault(kind, {}).setdefault(index, {})
+			entity_edits.update(fields)
+			entity_edits['updatedAt'] = int(time.time() * 1000)
+
+	def should_rate_limit(self):
+		with self.lock:
+			self.requests += 1
+			if (self.rate_limit_rate and self.random.random() < self.rate_limit_rate) or (
+					self.max_concurrent and self.active > self.max_concurrent):
+				self.rate_limited += 1
+				return True
+		return False
+
+	def start_request(self):
+		with self.lock:
+			self.active += 1
+			self.peak_active = max(self.peak_active, self.active)
+
+	def end_request(self):
+		with self.lock:
+			self.active -= 1
+
+	def page(self, kind, cursor):
+		start = int(cursor) if cursor else 0
+		end = min(start + self.page_size, self.sizes[kind])
+		next_cursor = str(end) if end < self.sizes[kind] else None
+		factory = {'conditions': synthetic_condition, 'channels': synthetic_channel, 'destinations': synthetic_destination,
+			'policies': synthetic_policy}[kind]
+		entities = [factory(i) for i in range(start, end)]
+		for i, fields in self.edits.get(kind, {}).items():
+			if start <= i < end:
+				entities[i - start].update(fields)
+		return entities, next_cursor
+
+	def respond(self, query):
+		"""
+		Returns the response body for a query, shaped like NerdGraph's own responses.
+		Batched queries with one aliased account block per account are answered per alias.
+		"""
+		actor = {}
+		for match in ACCOUNT_PATTERN.finditer(query):
+			depth = 1
+			end = match.end()
+			while depth:
+				depth += {'{': 1, '}': -1}.get(query[end], 0)
+				end += 1
+			account = self.account(query[match.end():end])
+			if account is None:
+				return {'data': None, 'errors': [{'message': 'Unsupported query', 'extensions': {'errorClass': 'BAD_USER_INPUT'}}]}
+			actor[match.group(1) or 'account'] = account
+		return {'data': {'actor': actor}}
+
+	def account(self, selection):
+		match = CURSOR_PATTERN.search(selection)
+		cursor = match.group(1) if match else None
+		if 'nrqlCondition' in selection:
+			entities, next_cursor = self.page('conditions', cursor)
+			return {'alerts': {'nrqlConditionsSearch': {'nrqlConditions': entities, 'nextCursor': next_cursor}}}
+		if 'policiesSearch' in selection:
+			entities, next_cursor = self.page('policies', cursor)
+			return {'alerts': {'policiesSearch': {'policies': entities, 'nextCursor': next_cursor}}}
+		if 'channels' in selection:
+			entities, next_cursor = self.page('channels', cursor)
+			return {'aiNotifications': {'channels': {'entities': entities, 'nextCursor': next_cursor}}}
+		if 'destinations' in selection:
+			entities, next_cursor = self.page('destinations', cursor)
+			return {'aiNotifications': {'destinations': {'entities': entities, 'nextCursor': next_cursor}}}
+		return None
+
+
+class MockNerdGraphHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def do_POST(self):
+		nerdgraph = self.server.nerdgraph
+		body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		nerdgraph.start_request()
+		try:
+			if nerdgraph.latency:
+				time.sleep(nerdgraph.latency)
+			rate_limited = nerdgraph.should_rate_limit()
+		finally:
+			nerdgraph.end_request()
+		if rate_limited:
+			self.send_json(429, {'errors': [{'message': 'Too many requests'}]}, {'Retry-After': str(nerdgraph.retry_after)})
+			return
+		try:
+			query = json.loads(body)['query']
+		except (ValueError, KeyError):
+			self.send_json(400, {'errors': [{'message': 'Malformed request'}]})
+			return
+		self.send_json(200, nerdgraph.respond(query))
+
+	def send_json(self, status, data, headers=None):
+		payload = json.dumps(data).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(payload)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def start_server(nerdgraph, host='127.0.0.1', port=0):
+	"""
+	Serve `nerdgraph` from a background thread. Returns the server and its GraphQL URL,
+	call server.shutdown() to stop it.
+	"""
+	server = ThreadingHTTPServer((host, port), MockNerdGraphHandler)
+	server.daemon_threads = True
+	server.nerdgraph = nerdgraph
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, f'http://{host}:{server.server_address[1]}/graphql'
+
+
+def add_server_arguments(parser):
+	parser.add_argument('--page-size', type=int, default=200, help='Entities per page')
+	parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+	parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+	parser.add_argument('--retry-after', type=int, default=0, help='Retry-After seconds sent with a 429')
+	parser.add_argument('--max-concurrent', type=int, default=0,
+		help='Answer requests with 429 while more than this many are in flight, 0 for no limit')
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Serve synthetic NerdGraph responses for local runs and benchmarks.')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8080)
+	parser.add_argument('--conditions', type=int, default=1000)
+	parser.add_argument('--channels', type=int, default=1000)
+	parser.add_argument('--destinations', type=int, default=1000)
+	parser.add_argument('--policies', type=int, default=250)
+	add_server_arguments(parser)
+	args = parser.parse_args()
+
+	nerdgraph = MockNerdGraph(args.conditions, args.channels, args.destinations, args.page_size, args.latency,
+		args.rate_limit_rate, args.retry_after, policies=args.policies, max_concurrent=args.max_concurrent)
+	server, url = start_server(nerdgraph, args.host, args.port)
+	print(f'Serving mock NerdGraph on {url}, point the importer at it with --nerdgraph-url {url}')
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		server.shutdown()
+
+
+if __name__ == '__main__':
+	main()
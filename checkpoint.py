@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+DEFAULT_CHECKPOINT_DIR = '.importer_checkpoint'
+
+
+class Checkpoint:
+	"""
+	Durable progress of a run, so an interrupted run can be resumed with --resume.
+	For every resource type it records the cursor of the next page to fetch and the
+	import IDs that were imported. Fetched entities are spooled to one NDJSON file
+	per resource type, the checkpoint keeps the spool's size at the last recorded
+	page so a page that was only partly written is dropped on resume.
+	"""
+	def __init__(self, directory=DEFAULT_CHECKPOINT_DIR, resume=False, save_interval=1.0):
+		# Absolute, shards exported to directories of their own are imported from there
+		self.directory = os.path.abspath(directory)
+		self.filename = os.path.join(self.directory, 'checkpoint.json')
+		self.save_interval = save_interval
+		self.last_saved = 0.0
+		# Pages are recorded from the prefetch thread, imports from the import stages
+		self.lock = threading.Lock()
+		self.spools = {}
+		self.state = {}
+		# resource_type -> progress checked against the handler's query in this run
+		self.current = {}
+		if resume:
+			self.state = self.load()
+		elif os.path.isdir(self.directory):
+			shutil.rmtree(self.directory)
+		os.makedirs(self.directory, exist_ok=True)
+
+	def load(self):
+		try:
+			with open(self.filename) as f:
+				state = json.load(f)
+		except FileNotFoundError:
+			logging.warning(f'No checkpoint in {self.directory}, starting from the beginning')
+			return {}
+		except ValueError as e:
+			logging.warning(f'Ignoring unreadable checkpoint {self.filename}: {e}')
+			return {}
+		for resource_type, progress in state.items():
+			logging.info(f"Resuming {resource_type}: {progress['entities']} resources fetched"
+				f"{'' if progress['fetch_complete'] else ', more pages to go'}, {len(progress['imported'])} imported")
+		return state
+
+	def save(self):
+		# Write to a temporary file and rename it, a crash leaves either the old or the new checkpoint
+		with self.lock:
+			fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+			with os.fdopen(fd, 'w') as f:
+				json.dump(self.state, f)
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmp_path, self.filename)
+			self.last_saved = time.monotonic()
+
+	def maybe_save(self):
+		if time.monotonic() - self.last_saved >= self.save_interval:
+			self.save()
+
+	def progress(self, resource_handler):
+		"""
+		Returns the progress of the handler's resource type, starting over when the
+		checkpoint was taken with a different query (account, fields or filters).
+		"""
+		if resource_handler.resource_type in self.current:
+			return self.current[resource_handler.resource_type]
+		query_hash = hashlib.sha256(resource_handler.build_query().encode()).hexdigest()
+		progress = self.state.get(resource_handler.resource_type)
+		if progress is not None and progress['query'] != query_hash:
+			logging.warning(f'Checkpoint for {resource_handler.resource_type} was taken with a different query, '
+				'starting it from the beginning')
+			progress = None
+		if progress is None:
+			progress = {'query': query_hash, 'cursor': None, 'fetch_complete': False, 'spool_size': 0, 'entities': 0,
+				'imported': []}
+			self.state[resource_handler.resource_type] = progress
+		self.current[resource_handler.resource_type] = progress
+		return progress
+
+	def spool_filename(self, resource_type):
+		return os.path.join(self.directory, resource_type + '.ndjson')
+
+	def start_cursor(self, resource_handler):
+		"""
+		Returns the cursor to continue fetching from, None for the first page.
+		"""
+		return self.progress(resource_handler)['cursor']
+
+	def fetch_complete(self, resource_handler):
+		return self.progress(resource_handler)['fetch_complete']
+
+	def replay(self, resource_handler):
+		"""
+		Returns the entities fetched by previous runs, and opens the spool for appending
+		the pages still to come.
+		"""
+		progress = self.progress(resource_handler)
+		filename = self.spool_filename(resource_handler.resource_type)
+		entities = []
+		if progress['spool_size']:
+			with open(filename, 'rb') as f:
+				data = f.read(progress['spool_size'])
+			entities = [resource_handler.parse_entity(json.loads(line)) for line in data.splitlines()]
+		spool = open(filename, 'ab')
+		spool.truncate(progress['spool_size'])
+		self.spools[resource_handler.resource_type] = spool
+		return entities
+
+	def record_page(self, resource_handler, entities, next_cursor):
+		"""
+		Spool a fetched page and move the resource type's cursor past it.
+		"""
+		progress = self.progress(resource_handler)
+		spool = self.spools.get(resource_handler.resource_type)
+		if spool is None:
+			self.replay(resource_handler)
+			spool = self.spools[resource_handler.resource_type]
+		spool.write(b''.join(json.dumps(entity.to_dict()).encode() + b'\n' for entity in entities))
+		spool.flush()
+		os.fsync(spool.fileno())
+		progress['spool_size'] = spool.tell()
+		progress['entities'] += len(entities)
+		progress['cursor'] = next_cursor
+		if not next_cursor:
+			progress['fetch_complete'] = True
+			self.save()
+		else:
+			self.maybe_save()
+
+	def record_pages(self, resource_handler, pages):
+		"""
+		Pass (entities, next_cursor) pages through, recording each one.
+		"""
+		for entities, next_cursor in pages:
+			self.record_page(resource_handler, entities, next_cursor)
+			yield entities, next_cursor
+
+	def filter_imported(self, resource_handler, resources):
+		"""
+		Returns (resources not imported by a previous run, number of resources skipped).
+		"""
+		imported = set(self.progress(resource_handler)['imported'])
+		remaining = [resource for resource in resources if resource_handler.get_import_id(resource) not in imported]
+		return remaining, len(resources) - len(remaining)
+
+	def mark_imported(self, resource_handler, resource):
+		# Import stages of several resource types may run at the same time
+		with self.lock:
+			self.progress(resource_handler)['imported'].append(resource_handler.get_import_id(resource))
+		self.maybe_save()
+
+	def close(self, completed=False):
+		"""
+		Close the spools and save the checkpoint, or remove it once the whole run completed.
+		"""
+		for spool in self.spools.values():
+			spool.close()
+		self.spools = {}
+		if completed:
+			shutil.rmtree(self.directory, ignore_errors=True)
+		else:
+			self.save()
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from instrumentation import increment
+
+
+# How a request or subprocess went, as recorded on its Slot
+SUCCESS = 'success'
+THROTTLED = 'throttled'
+FAILED = 'failed'
+
+# Weight of the newest sample in the smoothed latency
+LATENCY_WEIGHT = 0.2
+# Completions before latency is trusted as a congestion signal
+LATENCY_WARMUP = 10
+
+
+class Slot:
+	"""
+	One unit of in-flight work. Set outcome to THROTTLED or FAILED before the slot is
+	released when the work was rate limited or failed, it defaults to SUCCESS, or to
+	FAILED when an exception leaves the slot.
+	"""
+	__slots__ = ('outcome',)
+
+	def __init__(self):
+		self.outcome = None
+
+
+class AIMDController:
+	"""
+	Limit on concurrent requests or subprocesses that adapts to what the other side
+	can take, additive increase / multiplicative decrease like TCP congestion control.
+	Every completion that keeps the limit busy raises it by increase / limit, about
+	`increase` per round of requests. A throttled or failed completion, or a smoothed
+	latency grown beyond latency_tolerance times the fastest one seen, multiplies it
+	by `decrease`, at most once per smoothed latency since the requests in flight
+	together all see the same congestion. The limit stays within [minimum, maximum].
+
+	Slots are taken with slot() from threads, or with async_slot() from one event
+	loop. Share a controller between everything hitting the same backend.
+	"""
+	def __init__(self, name, maximum, minimum=1, initial=None, increase=1.0, decrease=0.5, latency_tolerance=3.0):
+		if minimum < 1 or maximum < minimum:
+			raise ValueError(f'Invalid {name} concurrency bounds: {minimum}..{maximum}')
+		self.name = name
+		self.minimum = minimum
+		self.maximum = maximum
+		self.limit = float(min(max(initial or maximum, minimum), maximum))
+		self.increase = increase
+		self.decrease = decrease
+		self.latency_tolerance = latency_tolerance
+		self.in_flight = 0
+		self.latency = None
+		self.min_latency = None
+		self.samples = 0
+		self.last_decrease = 0.0
+		self.condition = threading.Condition()
+		# (event loop, asyncio.Event) set by release() for coroutines waiting in acquire_async()
+		self.wakeup = None
+
+	def current_limit(self):
+		return int(self.limit)
+
+	def acquire(self):
+		with self.condition:
+			while self.in_flight >= self.current_limit():
+				self.condition.wait()
+			self.in_flight += 1
+
+	async def acquire_async(self):
+		while True:
+			with self.condition:
+				if self.in_flight < self.current_limit():
+					self.in_flight += 1
+					return
+				loop = asyncio.get_running_loop()
+				# A wakeup left over from the loop of an earlier asyncio.run() has no waiters left
+				if self.wakeup is None or self.wakeup[0] is not loop:
+					self.wakeup = (loop, asyncio.Event())
+				wakeup = self.wakeup[1]
+			await wakeup.wait()
+
+	def release(self, seconds, outcome=SUCCESS):
+		"""
+		Free a slot taken with acquire() and adapt the limit to how its work went.
+		"""
+		with self.condition:
+			saturated = self.in_flight >= self.current_limit()
+			self.in_flight -= 1
+			self.record(seconds, outcome, saturated)
+			self.condition.notify_all()
+			if self.wakeup is not None:
+				loop, wakeup = self.wakeup
+				self.wakeup = None
+				# asyncio.Event is not thread-safe and release() may run in an import worker thread
+				try:
+					loop.call_soon_threadsafe(wakeup.set)
+				except RuntimeError:
+					# The loop is closed, nobody is waiting any more
+					pass
+
+	def record(self, seconds, outcome, saturated):
+		self.samples += 1
+		self.latency = seconds if self.latency is None else self.latency + LATENCY_WEIGHT * (seconds - self.latency)
+		self.min_latency = seconds if self.min_latency is None else min(self.min_latency, seconds)
+		slow = self.samples > LATENCY_WARMUP and self.latency > self.min_latency * self.latency_tolerance
+		if outcome != SUCCESS or slow:
+			increment('concurrency_congestion', controller=self.name, signal=outcome if outcome != SUCCESS else 'latency')
+			now = time.monotonic()
+			if now - self.last_decrease >= self.latency:
+				self.last_decrease = now
+				self.set_limit(self.limit * self.decrease)
+		elif saturated:
+			# Only a limit that is actually used has shown it can be raised
+			self.set_limit(self.limit + self.increase / self.limit)
+
+	def set_limit(self, limit):
+		previous = self.current_limit()
+		self.limit = min(max(limit, self.minimum), self.maximum)
+		if self.current_limit() != previous:
+			increment('concurrency_limit_changes', controller=self.name,
+				direction='up' if self.current_limit() > previous else 'down')
+			logging.debug(f'{self.name} concurrency limit {previous} -> {self.current_limit()} '
+				f'(latency {self.latency:.2f}s, fastest {self.min_latency:.2f}s)')
+
+	@contextmanager
+	def slot(self):
+		"""
+		Hold a slot for the enclosed work, waiting while the limit is reached.
+		"""
+		self.acquire()
+		slot = Slot()
+		start = time.perf_counter()
+		try:
+			yield slot
+		except BaseException:
+			slot.outcome = slot.outcome or FAILED
+			raise
+		finally:
+			self.release(time.perf_counter() - start, slot.outcome or SUCCESS)
+
+	@asynccontextmanager
+	async def async_slot(self):
+		"""
+		asyncio form of slot().
+		"""
+		await self.acquire_async()
+		slot = Slot()
+		start = time.perf_counter()
+		try:
+			yield slot
+		except BaseException:
+			slot.outcome = slot.outcome or FAILED
+			raise
+		finally:
+			self.release(time.perf_counter() - start, slot.outcome or SUCCESS)
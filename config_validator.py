@@ -0,0 +1,576 @@
+import functools
+import glob
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from instrumentation import increment, span
+
+
+# Trimmed output of `terraform providers schema -json` for the resource types the importer
+# writes. A fresh dump of the whole provider can be used instead, see load_provider_schema
+DEFAULT_SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'provider_schema.json')
+# Roots of references that do not name a managed resource
+REFERENCE_ROOTS = {'var', 'local', 'module', 'data', 'path', 'terraform', 'count', 'each', 'self'}
+# Problems logged per run, the rest are only counted
+MAX_REPORTED_PROBLEMS = 50
+# Distinct lines and values whose parse is remembered, most lines of a large export repeat
+EXPRESSION_CACHE_SIZE = 65536
+
+IDENTIFIER = r'[A-Za-z_][\w-]*'
+ATTRIBUTE = re.compile(rf'({IDENTIFIER})\s*=\s*(.*?)\s*$')
+BLOCK_OPEN = re.compile(rf'({IDENTIFIER})((?:\s+(?:"(?:[^"\\]|\\.)*"|{IDENTIFIER}))*)\s*\{{$')
+BLOCK_LABEL = re.compile(rf'"((?:[^"\\]|\\.)*)"|({IDENTIFIER})')
+HEREDOC = re.compile(rf'<<(-?)({IDENTIFIER})$')
+QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+STRINGS = re.compile(r'"(?:[^"\\]|\\.)*"')
+NUMBER = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?')
+TRAVERSAL = re.compile(rf'{IDENTIFIER}(?:\.{IDENTIFIER}|\.\d+|\[\d+\])*')
+FUNCTION_CALL = re.compile(rf'{IDENTIFIER}\(.*\)')
+TEMPLATE_START = re.compile(r'([$%])\1\{|([$%])\{')
+ESCAPE = re.compile(r'\\(?:[nrt"\\]|u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8})')
+# What a line of HCL holds, see classify_line
+SKIP, COMMENT, CLOSE, BLOCK_LINE, ATTRIBUTE_LINE, INVALID = range(6)
+# A member of a generated .tf.json resource object, one per line
+JSON_MEMBER = re.compile(r'^"((?:[^"\\]|\\.)*)":')
+
+
+@dataclass(slots=True)
+class ConfigProblem:
+	filename: str
+	line: int
+	message: str
+
+	def __str__(self):
+		return f'{self.filename}:{self.line}: {self.message}'
+
+
+class ConfigValidationError(Exception):
+	"""
+	Raised when generated configuration would be rejected by terraform, with every problem found.
+	"""
+	def __init__(self, problems):
+		super().__init__(f'{len(problems)} problems in the generated configuration, first: {problems[0]}')
+		self.problems = problems
+
+
+@dataclass(slots=True)
+class Block:
+	type: str
+	labels: tuple
+	line: int
+	# name -> (expression, line)
+	attributes: dict = field(default_factory=dict)
+	blocks: list = field(default_factory=list)
+
+
+def load_provider_schema(filename=None):
+	"""
+	Returns resource_type -> block schema from the output of `terraform providers schema -json`,
+	the bundled snapshot unless another file is given.
+	"""
+	with open(filename or DEFAULT_SCHEMA_FILE) as f:
+		schema = json.load(f)
+	resource_schemas = {}
+	for provider in schema.get('provider_schemas', {}).values():
+		for resource_type, resource_schema in provider.get('resource_schemas', {}).items():
+			resource_schemas[resource_type] = prepare_block_schema(resource_schema['block'])
+	if not resource_schemas:
+		raise ValueError(f'No resource schemas in {filename or DEFAULT_SCHEMA_FILE}')
+	return resource_schemas
+
+
+def prepare_block_schema(schema):
+	"""
+	Add the types of the configurable arguments, the required ones and the nested block
+	limits to a block schema, so they are not looked up again for every block of a
+	large configuration.
+	"""
+	attributes = schema.get('attributes', {})
+	schema['configurable_attributes'] = {name: attribute['type'] for name, attribute in attributes.items()
+		if attribute.get('optional') or attribute.get('required')}
+	schema['required_attributes'] = [name for name, attribute in attributes.items() if attribute.get('required')]
+	schema['block_limits'] = []
+	for name, block_type in schema.get('block_types', {}).items():
+		maximum = 1 if block_type.get('nesting_mode') == 'single' else block_type.get('max_items', 0)
+		if block_type.get('min_items') or maximum:
+			schema['block_limits'].append((name, block_type.get('min_items', 0), maximum))
+		prepare_block_schema(block_type['block'])
+	return schema
+
+
+def parse_template(body):
+	"""
+	Returns the expressions of the ${...} sequences in a string's body, raising ValueError
+	on unterminated sequences. $${ and %%{ are literal.
+	"""
+	expressions = []
+	index = 0
+	while True:
+		match = TEMPLATE_START.search(body, index)
+		if match is None:
+			return expressions
+		if match.group(1):
+			index = match.end()
+			continue
+		depth = 1
+		end = match.end()
+		while depth and end < len(body):
+			depth += {'{': 1, '}': -1}.get(body[end], 0)
+			end += 1
+		if depth:
+			raise ValueError('Unterminated template sequence')
+		if match.group(2) == '$':
+			expressions.append(parse_expression(body[match.end():end - 1].strip()))
+		index = end
+
+
+def string_expression(body):
+	# A string without template sequences keeps its text, to check conversions to numbers and bools
+	references = parse_template(body) if '{' in body else []
+	return ('template', references) if references else ('string', body)
+
+
+def check_string_body(body):
+	if '\\' in body and '\\' in ESCAPE.sub('', body):
+		raise ValueError('Invalid escape sequence in string')
+	return string_expression(body)
+
+
+def split_elements(text):
+	"""
+	Split the inside of a list at its top level commas, outside of strings and brackets.
+	"""
+	elements = []
+	depth = 0
+	start = 0
+	in_string = False
+	index = 0
+	while index < len(text):
+		character = text[index]
+		if in_string:
+			if character == '\\':
+				index += 1
+			elif character == '"':
+				in_string = False
+		elif character == '"':
+			in_string = True
+		elif character in '[{(':
+			depth += 1
+		elif character in ']})':
+			depth -= 1
+		elif character == ',' and depth == 0:
+			elements.append(text[start:index].strip())
+			start = index + 1
+		index += 1
+	if text[start:].strip():
+		elements.append(text[start:].strip())
+	return elements
+
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def parse_expression(text):
+	"""
+	Classify an expression of the generated configuration. Returns (kind, detail):
+	('string', text), ('template', expressions in its ${...}), ('number', None), ('bool', None), ('null', None),
+	('reference', traversal parts), ('list', elements), ('object', None) or ('call', None).
+	Raises ValueError for anything terraform could not parse, whose value is then ('invalid', None).
+	"""
+	if not text:
+		raise ValueError('Missing value')
+	first = text[0]
+	if first == '"':
+		match = QUOTED.fullmatch(text)
+		if match is None:
+			raise ValueError('Invalid string, unterminated or followed by other characters')
+		return check_string_body(match.group(1))
+	if NUMBER.fullmatch(text):
+		return 'number', None
+	if text in ('true', 'false'):
+		return 'bool', None
+	if text == 'null':
+		return 'null', None
+	if TRAVERSAL.fullmatch(text):
+		return 'reference', re.split(r'\.|\[', text)
+	if first == '[' and text[-1] == ']':
+		return 'list', [parse_expression(element) for element in split_elements(text[1:-1])]
+	if first == '{' and text[-1] == '}':
+		return 'object', None
+	if FUNCTION_CALL.fullmatch(text):
+		return 'call', None
+	raise ValueError(f'Invalid expression: {text}')
+
+
+def _unbalanced(text):
+	# Open brackets of a multi-line list or object, outside of strings
+	depth = 0
+	for element in STRINGS.sub('""', text):
+		if element in '[{(':
+			depth += 1
+		elif element in ']})':
+			depth -= 1
+	return depth
+
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def classify_line(line):
+	"""
+	Returns what a line of HCL holds: (SKIP,), (COMMENT,) opening a block comment,
+	(CLOSE,), (BLOCK_LINE, type, labels), (ATTRIBUTE_LINE, name, value, heredoc delimiter,
+	expression or why it is invalid) or (INVALID, line). Cached, since most
+	lines of a large configuration repeat.
+	"""
+	line = line.strip()
+	if not line or line[0] == '#' or line.startswith('//'):
+		return (SKIP,)
+	if line.startswith('/*'):
+		return (SKIP,) if '*/' in line else (COMMENT,)
+	if line == '}':
+		return (CLOSE,)
+	match = ATTRIBUTE.match(line)
+	if match is not None:
+		name, value = match.groups()
+		heredoc = HEREDOC.match(value)
+		if heredoc is not None:
+			return ATTRIBUTE_LINE, name, value, heredoc.group(2), None
+		try:
+			return ATTRIBUTE_LINE, name, value, None, parse_expression(value)
+		except ValueError as e:
+			return ATTRIBUTE_LINE, name, value, None, str(e)
+	match = BLOCK_OPEN.match(line)
+	if match is not None:
+		return BLOCK_LINE, match.group(1), tuple(quoted if quoted is not None else bare
+			for quoted, bare in BLOCK_LABEL.findall(match.group(2)))
+	return INVALID, line
+
+
+def parse_hcl(lines, filename, problems):
+	"""
+	Parse the HCL the importer writes: one attribute or block header per line, heredocs,
+	and lists or objects that may span lines. Yields every top level block as soon as
+	it is closed, so a large file is never held in memory, and appends syntax errors
+	to problems.
+	"""
+	root = Block('', (), 0)
+	stack = [root]
+	lines = iter(lines)
+	number = 0
+	for line in lines:
+		number += 1
+		entry = classify_line(line)
+		kind = entry[0]
+		if kind == CLOSE:
+			if len(stack) == 1:
+				problems.append(ConfigProblem(filename, number, 'Unexpected "}", no block is open'))
+				continue
+			block = stack.pop()
+			if len(stack) == 1:
+				yield block
+			continue
+		if kind == ATTRIBUTE_LINE:
+			_, name, value, delimiter, expression = entry
+			attributes = stack[-1].attributes
+			if delimiter is None and expression.__class__ is tuple and name not in attributes:
+				# The common case, a complete value on its line
+				attributes[name] = (expression, number)
+				continue
+			start = number
+			try:
+				if delimiter is not None:
+					body = []
+					for line in lines:
+						number += 1
+						if line.strip() == delimiter:
+							break
+						body.append(line.rstrip('\n'))
+					else:
+						raise ValueError(f'Unterminated heredoc, no closing {delimiter}')
+					expression = string_expression('\n'.join(body))
+				elif isinstance(expression, str):
+					# A list or object spanning lines, parsed once it is complete
+					if _unbalanced(value) <= 0:
+						raise ValueError(expression)
+					for line in lines:
+						number += 1
+						value += ' ' + line.strip()
+						if _unbalanced(value) <= 0:
+							break
+					expression = parse_expression(value)
+			except ValueError as e:
+				problems.append(ConfigProblem(filename, start, f'{e} in "{name}"'))
+				# Still set, so the block is not also reported as missing it
+				expression = 'invalid', None
+			if name in attributes:
+				problems.append(ConfigProblem(filename, start,
+					f'Attribute redefined: "{name}" was already set on line {attributes[name][1]}'))
+				continue
+			attributes[name] = (expression, start)
+		elif kind == BLOCK_LINE:
+			block = Block(entry[1], entry[2], number)
+			if len(stack) > 1:
+				stack[-1].blocks.append(block)
+			stack.append(block)
+		elif kind == COMMENT:
+			for line in lines:
+				number += 1
+				if '*/' in line:
+					break
+		elif kind == INVALID:
+			problems.append(ConfigProblem(filename, number, f'Invalid syntax: {entry[1]}'))
+
+	for block in stack[1:]:
+		problems.append(ConfigProblem(filename, block.line, f'Unclosed "{block.type}" block'))
+	if len(stack) > 1:
+		yield stack[1]
+
+
+def json_expression(value):
+	if isinstance(value, str):
+		return string_expression(value)
+	if isinstance(value, bool):
+		return 'bool', None
+	if isinstance(value, (int, float)):
+		return 'number', None
+	if value is None:
+		return 'null', None
+	if isinstance(value, list):
+		return 'list', [json_expression(element) for element in value]
+	return 'object', None
+
+
+def json_block(block_type, labels, config, line, schema, filename, problems):
+	"""
+	Build a Block from the JSON object of a resource. Which members are nested blocks
+	only follows from the schema, as terraform's own JSON syntax does.
+	"""
+	block = Block(block_type, labels, line)
+	block_types = schema.get('block_types', {}) if schema else {}
+	for name, value in config.items():
+		if name in block_types:
+			for nested in value if isinstance(value, list) else [value]:
+				if not isinstance(nested, dict):
+					problems.append(ConfigProblem(filename, line, f'"{name}" blocks must be JSON objects'))
+					continue
+				block.blocks.append(json_block(name, (), nested, line, block_types[name]['block'], filename, problems))
+			continue
+		try:
+			block.attributes[name] = (json_expression(value), line)
+		except ValueError as e:
+			problems.append(ConfigProblem(filename, line, f'{e} in "{name}"'))
+			block.attributes[name] = (('invalid', None), line)
+	return block
+
+
+def parse_tf_json(text, filename, resource_schemas, problems):
+	"""
+	Parse a .tf.json file into resource Blocks, appending its problems to problems.
+	"""
+	try:
+		document = json.loads(text)
+	except ValueError as e:
+		problems.append(ConfigProblem(filename, getattr(e, 'lineno', 1), f'Invalid JSON: {e}'))
+		return []
+	# The importer writes one resource per line, other files point at their first line
+	lines = {}
+	for number, line in enumerate(text.split('\n'), 1):
+		match = JSON_MEMBER.match(line)
+		if match is not None:
+			lines.setdefault(match.group(1), number)
+	blocks = []
+	resources = document.get('resource', {}) if isinstance(document, dict) else {}
+	for resource_type, resources_of_type in resources.items():
+		for name, config in resources_of_type.items():
+			line = lines.get(name, 1)
+			if not isinstance(config, dict):
+				problems.append(ConfigProblem(filename, line, f'Resource {resource_type}.{name} must be a JSON object'))
+				continue
+			blocks.append(json_block('resource', (resource_type, name), config, line,
+				resource_schemas.get(resource_type), filename, problems))
+	return blocks
+
+
+def type_name(schema_type):
+	return schema_type if isinstance(schema_type, str) else f'{schema_type[0]} of {type_name(schema_type[1])}'
+
+
+def conforms(expression, schema_type):
+	"""
+	Whether terraform could convert the value to the attribute's type. References,
+	templates and function calls are only known at plan time and are accepted.
+	"""
+	kind, detail = expression
+	if kind in ('reference', 'template', 'call', 'null', 'invalid'):
+		return True
+	if isinstance(schema_type, list):
+		if schema_type[0] in ('list', 'set'):
+			return kind == 'list' and all(conforms(element, schema_type[1]) for element in detail)
+		return kind == 'object'
+	if schema_type == 'string':
+		return kind in ('string', 'number', 'bool')
+	# Quoted literals convert to numbers and bools only when they spell one
+	if schema_type == 'number':
+		return kind == 'number' or (kind == 'string' and NUMBER.fullmatch(detail) is not None)
+	if schema_type == 'bool':
+		return kind == 'bool' or (kind == 'string' and detail in ('true', 'false'))
+	return True
+
+
+def references(expression):
+	kind, detail = expression
+	if kind == 'reference':
+		yield detail
+	elif kind == 'template':
+		for template_expression in detail:
+			yield from references(template_expression)
+	elif kind == 'list':
+		for element in detail:
+			yield from references(element)
+
+
+def validate_block(block, schema, filename, problems, found_references):
+	attributes = schema.get('attributes', {})
+	block_types = schema.get('block_types', {})
+	configurable = schema['configurable_attributes']
+	for name, (expression, line) in block.attributes.items():
+		schema_type = configurable.get(name)
+		if schema_type is None:
+			if name in attributes:
+				detail = 'is set by the provider and can not be configured'
+			elif name in block_types:
+				detail = 'is a block, not an argument'
+			else:
+				detail = 'is not expected here'
+			problems.append(ConfigProblem(filename, line, f'Unsupported argument: "{name}" {detail}'))
+			continue
+		if not conforms(expression, schema_type):
+			problems.append(ConfigProblem(filename, line, f'Incorrect attribute value type: "{name}" must be a {type_name(schema_type)}'))
+		if expression[0] in ('reference', 'template', 'list'):
+			for parts in references(expression):
+				found_references.append((filename, line, parts))
+	for name in schema['required_attributes']:
+		if name not in block.attributes:
+			problems.append(ConfigProblem(filename, block.line, f'Missing required argument: "{name}" is required in "{block.type}"'))
+
+	counts = {}
+	for nested in block.blocks:
+		block_type = block_types.get(nested.type)
+		if block_type is None:
+			detail = f'is an argument, write {nested.type} = ...' if nested.type in attributes else 'is not expected here'
+			problems.append(ConfigProblem(filename, nested.line, f'Unsupported block type: "{nested.type}" {detail}'))
+			continue
+		if nested.labels:
+			problems.append(ConfigProblem(filename, nested.line, f'Extraneous label for "{nested.type}" block'))
+		counts[nested.type] = counts.get(nested.type, 0) + 1
+		validate_block(nested, block_type['block'], filename, problems, found_references)
+	for name, minimum, maximum in schema['block_limits']:
+		count = counts.get(name, 0)
+		if count < minimum:
+			problems.append(ConfigProblem(filename, block.line,
+				f'Insufficient "{name}" blocks: at least {minimum} required in "{block.type}"'))
+		if maximum and count > maximum:
+			problems.append(ConfigProblem(filename, block.line, f'Too many "{name}" blocks: no more than {maximum} allowed'))
+
+
+def declared_resources(directory, skip=()):
+	"""
+	Returns the type.name of every managed resource declared in the directory's other files.
+	"""
+	declared = set()
+	for filename in glob.glob(os.path.join(directory, '*.tf')) + glob.glob(os.path.join(directory, '*.tf.json')):
+		if os.path.normpath(filename) in skip:
+			continue
+		with open(filename) as f:
+			text = f.read()
+		if filename.endswith('.json'):
+			try:
+				resources = json.loads(text).get('resource', {})
+			except (ValueError, AttributeError):
+				continue
+			declared.update(f'{resource_type}.{name}' for resource_type, names in resources.items() for name in names)
+		else:
+			declared.update(f'{resource_type}.{name}' for resource_type, name in
+				re.findall(r'^[ \t]*resource[ \t]+"([^"]+)"[ \t]+"([^"]+)"', text, re.MULTILINE))
+	return declared
+
+
+def validate_resources(blocks, resource_schemas, filename, problems, addresses, found_references):
+	for block in blocks:
+		if block.type != 'resource':
+			continue
+		if len(block.labels) != 2:
+			problems.append(ConfigProblem(filename, block.line, 'A resource block needs a type and a name label'))
+			continue
+		address = '.'.join(block.labels)
+		if address in addresses:
+			problems.append(ConfigProblem(filename, block.line,
+				f'Duplicate resource {address}, already declared at {":".join(map(str, addresses[address]))}'))
+			continue
+		addresses[address] = (filename, block.line)
+		schema = resource_schemas.get(block.labels[0])
+		if schema is None:
+			if block.labels[0].startswith('newrelic_'):
+				problems.append(ConfigProblem(filename, block.line, f'Unknown resource type {block.labels[0]}'))
+			continue
+		validate_block(block, schema, filename, problems, found_references)
+
+
+def validate_files(filenames, resource_schemas, directory='.'):
+	"""
+	Parse the configuration files and check every resource whose type is in the schema:
+	known arguments and blocks, required ones present, values of the right type, no
+	attribute set twice, no address declared twice, and references only to resources
+	declared in these files or elsewhere in the directory. Returns the problems found.
+	"""
+	problems = []
+	addresses = {}
+	found_references = []
+	for filename in filenames:
+		with open(filename) as f:
+			if filename.endswith('.json'):
+				blocks = parse_tf_json(f.read(), filename, resource_schemas, problems)
+			else:
+				blocks = parse_hcl(f, filename, problems)
+			validate_resources(blocks, resource_schemas, filename, problems, addresses, found_references)
+
+	unresolved = [(filename, line, parts) for filename, line, parts in found_references if reference_problem(parts, addresses)]
+	if unresolved:
+		# Only read the directory's other files when these do not declare everything referenced
+		declared = declared_resources(directory, {os.path.normpath(filename) for filename in filenames})
+		for filename, line, parts in unresolved:
+			problem = reference_problem(parts, declared)
+			if problem:
+				problems.append(ConfigProblem(filename, line, problem))
+	order = {filename: index for index, filename in enumerate(filenames)}
+	return sorted(problems, key=lambda problem: (order.get(problem.filename, len(order)), problem.line))
+
+
+def reference_problem(parts, declared):
+	if parts[0] in REFERENCE_ROOTS:
+		return None
+	if len(parts) < 3:
+		return (f'Invalid reference "{".".join(parts)}": a resource reference needs a type, a name and an attribute, '
+			f'a bare word is only valid as a quoted string')
+	if f'{parts[0]}.{parts[1]}' not in declared:
+		return f'Reference to undeclared resource {parts[0]}.{parts[1]}'
+	return None
+
+
+def validate_config(resource_handlers, resource_schemas):
+	"""
+	Validate the configuration files of the resource handlers in the current directory
+	before anything is imported, logging every problem with its file and line.
+	Raises ConfigValidationError when terraform would reject them.
+	"""
+	filenames = [filename for resource_handler in resource_handlers for filename in resource_handler.get_config_filenames()]
+	with span('validate_config'):
+		problems = validate_files(filenames, resource_schemas)
+	if not problems:
+		logging.info(f'Validated {len(filenames)} configuration files')
+		return
+	increment('config_validation_errors', len(problems))
+	for problem in problems[:MAX_REPORTED_PROBLEMS]:
+		logging.error(f'Invalid configuration: {problem}')
+	if len(problems) > MAX_REPORTED_PROBLEMS:
+		logging.error(f'... and {len(problems) - MAX_REPORTED_PROBLEMS} more problems')
+	raise ConfigValidationError(problems)
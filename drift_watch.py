@@ -0,0 +1,291 @@
+import difflib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+import requests
+from import_graph import AddressIndex
+from incremental import entity_hash, load_snapshot, read_resource_blocks
+from instrumentation import increment, span
+from models import ModelError
+from nerdgraph_client import NerdGraphError
+from newrelic_resource import HCL_FORMAT, JSON_FORMAT
+from query_builder import build_search_query
+
+
+DEFAULT_EVENTS_FILE = 'drift_events.ndjson'
+DEFAULT_PATCH_DIR = 'drift'
+DEFAULT_WATCH_INTERVAL = 300
+
+
+class DriftWatcher:
+	"""
+	Polls New Relic with the resource handlers and reports every entity that was added,
+	changed or removed since the previous poll as a drift event, together with a patch
+	bringing the generated configuration in line.
+
+	The last known entities are kept in memory by ID with their hash, starting from the
+	snapshot of the last export. For resource types with a version_field a poll first
+	fetches only IDs and versions, and fetches the full entities only when one of them
+	changed, so an unchanged account costs a light pass instead of a full export.
+	"""
+	def __init__(self, resource_handlers, events_file=DEFAULT_EVENTS_FILE, patch_dir=DEFAULT_PATCH_DIR):
+		self.resource_handlers = resource_handlers
+		self.events_file = events_file
+		self.patch_dir = patch_dir
+		# resource_type -> {id: (hash, entity)}, None until the first poll of a type without a snapshot
+		self.known = {}
+		# resource_type -> {id: version} of the last full fetch
+		self.versions = {}
+		# Resource types whose version pass failed, e.g. without the field in the schema, always fetch in full
+		self.full_fetch_only = set()
+		# References are rendered as <address>.id like in an export of several types
+		self.address_index = AddressIndex() if len(resource_handlers) > 1 else None
+
+	def load_baseline(self):
+		"""
+		Start from the snapshots written by the last export, so drift that happened since
+		is reported by the first poll. Types without a snapshot start from their first poll.
+		"""
+		for resource_handler in self.resource_handlers:
+			resource_type = resource_handler.resource_type
+			snapshot = load_snapshot(resource_type + 'before_change')
+			if snapshot is None:
+				logging.info(f'No snapshot of {resource_type}, its first poll is the baseline')
+				self.known[resource_type] = None
+				continue
+			try:
+				self.known[resource_type] = {entity_id: (snapshot.hash(entity_id), resource_handler.parse_entity(snapshot.get(entity_id)))
+					for entity_id in snapshot.ids()}
+			finally:
+				snapshot.close()
+			logging.info(f'Watching {len(self.known[resource_type])} {resource_type} resources from the last snapshot')
+		self.index_addresses(self.resource_handlers)
+
+	def index_addresses(self, resource_handlers):
+		if self.address_index is None:
+			return
+		for resource_handler in resource_handlers:
+			known = self.known.get(resource_handler.resource_type) or {}
+			self.address_index.add(resource_handler, (entity for _, entity in known.values()))
+			resource_handler.address_index = self.address_index
+
+	def fetch_versions(self, resource_handler):
+		"""
+		Returns {id: version} of the entities the handler imports, fetching only the
+		fields needed to filter them and the version field. None when NerdGraph rejects
+		the query, the type is then fetched in full from now on.
+		"""
+		fields = resource_handler.summary_fields + [resource_handler.version_field]
+		versions = {}
+		cursor = None
+		try:
+			while True:
+				with span('drift_version_page', resource_type=resource_handler.resource_type):
+					data = resource_handler.client.execute(build_search_query(resource_handler.account_id,
+						resource_handler.search_path, resource_handler.entities_field, fields, cursor,
+						resource_handler.get_search_arguments()), resource_handler.account_id, cursor)
+				result = resource_handler.get_search_result(data)
+				for entity in result[resource_handler.entities_field]:
+					if resource_handler.include_entity(entity):
+						versions[entity['id']] = entity.get(resource_handler.version_field)
+				cursor = result['nextCursor']
+				if not cursor:
+					return versions
+		except NerdGraphError as e:
+			if not e.errors:
+				raise
+			logging.warning(f'Fetching {resource_handler.version_field} of {resource_handler.resource_type} failed, '
+				f'fetching all of it on every poll from now on: {e}')
+			self.full_fetch_only.add(resource_handler.resource_type)
+			return None
+
+	def unchanged(self, resource_handler, versions):
+		known = self.known.get(resource_handler.resource_type)
+		previous = self.versions.get(resource_handler.resource_type, {})
+		return (known is not None and versions.keys() == known.keys()
+			and all(version is not None and version == previous.get(entity_id) for entity_id, version in versions.items()))
+
+	def poll(self, resource_handler):
+		"""
+		Poll one resource type. Returns its drift events, empty when nothing changed.
+		"""
+		resource_type = resource_handler.resource_type
+		versions = None
+		if resource_handler.version_field and resource_type not in self.full_fetch_only:
+			versions = self.fetch_versions(resource_handler)
+			if versions is not None and self.unchanged(resource_handler, versions):
+				increment('drift_polls_unchanged', resource_type=resource_type)
+				return []
+
+		current = {}
+		for entity in resource_handler.iter_resources():
+			current[entity.id] = (entity_hash(entity), entity)
+		known = self.known.get(resource_type)
+		self.known[resource_type] = current
+		if versions is not None:
+			self.versions[resource_type] = versions
+		if known is None:
+			logging.info(f'Watching {len(current)} {resource_type} resources')
+			self.index_addresses([resource_handler])
+			return []
+
+		added = [entity for entity_id, (_, entity) in current.items() if entity_id not in known]
+		changed = [(known[entity_id][1], entity) for entity_id, (current_hash, entity) in current.items()
+			if entity_id in known and known[entity_id][0] != current_hash]
+		removed = [entity for entity_id, (_, entity) in known.items() if entity_id not in current]
+		if not (added or changed or removed):
+			return []
+
+		if self.address_index is not None:
+			self.address_index.add(resource_handler, added + [entity for _, entity in changed])
+		patch_file = self.write_patch(resource_handler, added, changed, removed)
+		events = []
+		for entity in added:
+			events.append(self.event(resource_handler, 'added', entity, patch_file=patch_file))
+		for previous, entity in changed:
+			events.append(self.event(resource_handler, 'changed', entity, previous, patch_file))
+		for entity in removed:
+			events.append(self.event(resource_handler, 'removed', entity, patch_file=patch_file))
+		return events
+
+	def event(self, resource_handler, kind, entity, previous=None, patch_file=None):
+		event = {
+			'time': datetime.now(timezone.utc).isoformat(),
+			'event': kind,
+			'resource_type': resource_handler.resource_type,
+			'account_id': resource_handler.account_id,
+			'id': entity.id,
+			'address': resource_handler.get_resource_address(entity)
+		}
+		if previous is not None:
+			old, new = previous.to_dict(), entity.to_dict()
+			event['fields'] = sorted(key for key in new.keys() | old.keys() if old.get(key) != new.get(key))
+			previous_address = resource_handler.get_resource_address(previous)
+			if previous_address != event['address']:
+				event['previous_address'] = previous_address
+		event['patch'] = patch_file
+		return event
+
+	def write_patch(self, resource_handler, added, changed, removed):
+		"""
+		Write a unified diff against the generated configuration files that adds, replaces
+		and removes the blocks of the drifted entities, to be applied with `git apply`
+		or `patch -p1` after review. Returns its file name, or None when the
+		configuration already matches.
+		"""
+		files = {}
+		block_files = {}
+		for config_filename in resource_handler.get_config_filenames():
+			files[config_filename] = read_resource_blocks(config_filename)
+			for address in files[config_filename]:
+				block_files[address] = config_filename
+		originals = {config_filename: dict(blocks) for config_filename, blocks in files.items()}
+
+		def render(entity, config_filename):
+			return resource_handler.render_block(entity, JSON_FORMAT if config_filename.endswith('.json') else HCL_FORMAT)
+
+		for entity in removed:
+			address = resource_handler.get_resource_address(entity)
+			if address in block_files:
+				del files[block_files.pop(address)][address]
+		# A changed block stays where it was in its file, so the patch only touches that block
+		moved = []
+		for previous, entity in changed:
+			old_address = resource_handler.get_resource_address(previous)
+			address = resource_handler.get_resource_address(entity)
+			config_filename = block_files.get(old_address)
+			if config_filename != resource_handler.get_entity_config_filename(entity) or (
+					address != old_address and address in block_files):
+				if config_filename is not None:
+					del files[block_files.pop(old_address)][old_address]
+				moved.append(entity)
+				continue
+			block = render(entity, config_filename)
+			files[config_filename] = {(address if existing == old_address else existing): (block if existing == old_address else text)
+				for existing, text in files[config_filename].items()}
+			del block_files[old_address]
+			block_files[address] = config_filename
+		for entity in added + moved:
+			address = resource_handler.get_resource_address(entity)
+			config_filename = resource_handler.get_entity_config_filename(entity)
+			if block_files.get(address) not in (None, config_filename):
+				del files[block_files.pop(address)][address]
+			files.setdefault(config_filename, {})[address] = render(entity, config_filename)
+			block_files[address] = config_filename
+
+		patch = []
+		for config_filename, blocks in files.items():
+			if blocks == originals.get(config_filename):
+				continue
+			try:
+				with open(config_filename) as f:
+					old_text = f.read()
+			except FileNotFoundError:
+				old_text = ''
+			new_text = ''
+			if blocks:
+				tf_file = io.StringIO()
+				resource_handler.write_config_blocks(tf_file, blocks.values(),
+					output_format=JSON_FORMAT if config_filename.endswith('.json') else HCL_FORMAT)
+				new_text = tf_file.getvalue()
+			patch.extend(difflib.unified_diff(old_text.splitlines(keepends=True), new_text.splitlines(keepends=True),
+				'a/' + config_filename if old_text else '/dev/null', 'b/' + config_filename if new_text else '/dev/null'))
+		if not patch:
+			return None
+
+		os.makedirs(self.patch_dir, exist_ok=True)
+		timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+		patch_file = os.path.join(self.patch_dir, f'{timestamp}-{resource_handler.resource_type}.patch')
+		with open(patch_file, 'w') as f:
+			f.writelines(patch)
+		return patch_file
+
+	def poll_all(self):
+		"""
+		Poll every resource type once and append their drift events to the events file.
+		A type that fails to poll keeps its last known entities and is polled again next time.
+		Returns the events.
+		"""
+		events = []
+		for resource_handler in self.resource_handlers:
+			resource_type = resource_handler.resource_type
+			try:
+				with span('drift_poll', resource_type=resource_type):
+					type_events = self.poll(resource_handler)
+			except (requests.exceptions.RequestException, NerdGraphError, KeyError, ModelError) as e:
+				logging.error(f'Error polling {resource_type} resources: {e}')
+				increment('drift_poll_failures', resource_type=resource_type)
+				continue
+			for event in type_events:
+				increment('drift_events', resource_type=resource_type, event=event['event'])
+				logging.warning(f"Drift: {resource_type} {event['id']} {event['event']} ({event['address']})"
+					+ (f", patch in {event['patch']}" if event['patch'] else ''))
+			events.extend(type_events)
+		if events:
+			with open(self.events_file, 'a') as f:
+				for event in events:
+					f.write(json.dumps(event) + '\n')
+		return events
+
+	def run(self, interval=DEFAULT_WATCH_INTERVAL, count=0, stop=None, on_poll=None):
+		"""
+		Poll every `interval` seconds until `stop` is set, or `count` polls when given.
+		on_poll is called after every poll with its events.
+		"""
+		stop = stop or threading.Event()
+		self.load_baseline()
+		polls = 0
+		while not stop.is_set():
+			start = time.perf_counter()
+			events = self.poll_all()
+			polls += 1
+			logging.info(f'Poll {polls} found {len(events)} drift events in {time.perf_counter() - start:.1f}s')
+			if on_poll is not None:
+				on_poll(events)
+			if count and polls >= count:
+				break
+			stop.wait(interval)
@@ -0,0 +1,72 @@
+import json
+import re
+
+
+# Alert conditions the importer always left out, used when no name filters are configured
+DEFAULT_EXCLUDE_NAMES = ['Web Ping Health Check', 'Services down for']
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+
+def compile_patterns(patterns):
+	"""
+	Combine regular expressions into one, so a name is matched in a single pass. Returns None for no patterns.
+	"""
+	if not patterns:
+		return None
+	return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+
+
+class ConditionFilter:
+	"""
+	Selects the NRQL conditions to import. What NerdGraph's searchCriteria can express
+	is sent with the query, everything is checked again on the client against the raw
+	entity, with the name patterns compiled into one include and one exclude matcher.
+	"""
+	def __init__(self, policy_ids=None, include_names=None, exclude_names=None, enabled_only=False):
+		self.policy_ids = set(str(policy_id) for policy_id in policy_ids or [])
+		self.include_names = list(include_names or [])
+		self.exclude_names = list(exclude_names or [])
+		self.enabled_only = enabled_only
+		self.include = compile_patterns(self.include_names)
+		self.exclude = compile_patterns(self.exclude_names)
+
+	def search_criteria(self):
+		"""
+		Returns the searchCriteria fields NerdGraph can filter on: a single policy ID
+		and a single plain (non-regex) name include.
+		"""
+		criteria = {}
+		if len(self.policy_ids) == 1:
+			criteria['policyId'] = next(iter(self.policy_ids))
+		if len(self.include_names) == 1 and not REGEX_METACHARACTERS.intersection(self.include_names[0]):
+			criteria['nameLike'] = self.include_names[0]
+		return criteria
+
+	def matches(self, entity):
+		if self.policy_ids and str(entity['policyId']) not in self.policy_ids:
+			return False
+		if self.enabled_only and not entity['enabled']:
+			return False
+		if self.include is not None and not self.include.search(entity['name']):
+			return False
+		return self.exclude is None or not self.exclude.search(entity['name'])
+
+
+def load_condition_filter(config_file=None, policy_ids=None, include_names=None, exclude_names=None, enabled_only=False):
+	"""
+	Build a ConditionFilter from an optional JSON config file, with any options given
+	on the command line taking precedence over the file's. The config file may hold
+	policy_ids, include_names, exclude_names and enabled_only.
+	"""
+	config = {}
+	if config_file:
+		with open(config_file) as f:
+			config = json.load(f)
+	if include_names is None and exclude_names is None and 'include_names' not in config and 'exclude_names' not in config:
+		exclude_names = DEFAULT_EXCLUDE_NAMES
+	return ConditionFilter(
+		policy_ids=policy_ids if policy_ids is not None else config.get('policy_ids'),
+		include_names=include_names if include_names is not None else config.get('include_names'),
+		exclude_names=exclude_names if exclude_names is not None else config.get('exclude_names'),
+		enabled_only=enabled_only or config.get('enabled_only', False)
+	)
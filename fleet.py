@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import Metrics
+from utils import prepare_root_module
+
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+# Written by every account's run in its own directory
+ACCOUNT_REPORT = 'importer_report.json'
+ACCOUNT_LOG = 'importer.log'
+# Options of the fleet run itself, not passed on to the accounts' runs
+FLEET_OPTIONS = ('--fleet', '--fleet-workers', '--fleet-dir', '--account-ids', '--report', '--prometheus-textfile')
+
+
+def load_manifest(filename):
+	"""
+	Read the accounts of a fleet from a JSON manifest:
+	{"accounts": [{"account_id": "1111111", "api_key_env": "PROD_API_KEY"}, ...]}.
+	Every account may give its API key as api_key or as the name of an environment
+	variable in api_key_env (default API_KEY), its working directory relative to the
+	fleet directory (default its ID) and extra command line arguments in args.
+	"""
+	with open(filename) as f:
+		manifest = json.load(f)
+	accounts = manifest.get('accounts') if isinstance(manifest, dict) else None
+	if not accounts:
+		raise ValueError(f'{filename} lists no accounts')
+	directories = set()
+	for account in accounts:
+		if not account.get('account_id'):
+			raise ValueError(f'Account without account_id in {filename}: {account}')
+		account['account_id'] = str(account['account_id'])
+		account.setdefault('directory', account['account_id'])
+		if account['directory'] in directories:
+			raise ValueError(f"Two accounts in {filename} share the directory {account['directory']}")
+		directories.add(account['directory'])
+	return accounts
+
+
+def account_argv(argv, args):
+	"""
+	Returns the command line for one account's run: the fleet's own, without the fleet
+	options, and with paths shared by all accounts made absolute.
+	"""
+	result = []
+	skip = False
+	for arg in argv:
+		if skip:
+			skip = False
+			continue
+		name = arg.split('=', 1)[0]
+		if name in FLEET_OPTIONS:
+			skip = '=' not in arg
+			continue
+		result.append(arg)
+	# Later occurrences win, these override relative paths given before
+	if args.filter_config:
+		result += ['--filter-config', os.path.abspath(args.filter_config)]
+	if args.cache_dir:
+		result += ['--cache-dir', os.path.abspath(args.cache_dir)]
+	if args.provider_schema:
+		result += ['--provider-schema', os.path.abspath(args.provider_schema)]
+	return result + ['--report', ACCOUNT_REPORT]
+
+
+def run_account(account, argv, fleet_dir, providers_file, init=True, offline=False):
+	"""
+	Run the whole fetch, render and import pipeline for one account in a process of
+	its own, in its own working directory (and terraform state). Returns its result.
+	"""
+	directory = os.path.abspath(os.path.join(fleet_dir, account['directory']))
+	result = {'account_id': account['account_id'], 'directory': directory, 'log': os.path.join(directory, ACCOUNT_LOG)}
+	api_key = account.get('api_key') or os.getenv(account.get('api_key_env', 'API_KEY'))
+	if not api_key and not offline:
+		result.update(status='failed', error=f"No API key, set {account.get('api_key_env', 'API_KEY')} or api_key")
+		return result
+
+	# Runs in a thread next to other accounts, so nothing here may change the working directory
+	os.makedirs(directory, exist_ok=True)
+	prepare_root_module(directory, providers_file, init)
+	env = dict(os.environ, ACCOUNT_ID=account['account_id'], API_KEY=api_key or '')
+	report_file = os.path.join(directory, ACCOUNT_REPORT)
+	if os.path.exists(report_file):
+		os.remove(report_file)
+	logging.info(f"Starting account {account['account_id']} in {directory}")
+	start = time.perf_counter()
+	with open(result['log'], 'w') as log:
+		process = subprocess.run([sys.executable, MAIN_SCRIPT] + argv + account.get('args', []), cwd=directory, env=env,
+			stdout=log, stderr=subprocess.STDOUT)
+	result['duration_seconds'] = time.perf_counter() - start
+	result['returncode'] = process.returncode
+	try:
+		with open(report_file) as f:
+			result['report'] = json.load(f)
+	except (OSError, ValueError):
+		result['report'] = None
+	result['status'] = 'succeeded' if process.returncode == 0 else 'failed'
+	if process.returncode == 0 and result['report'] is not None:
+		failures = sum(counter['value'] for counter in result['report']['counters']
+			if counter['name'] in ('import_failures', 'nerdgraph_failures'))
+		if failures:
+			result['status'] = 'partial'
+	logging.info(f"Account {account['account_id']} {result['status']} in {result['duration_seconds']:.1f}s, "
+		f"log in {result['log']}")
+	return result
+
+
+def run_fleet(manifest_file, argv, args):
+	"""
+	Run every account of the manifest, at most args.fleet_workers at a time. Returns the
+	fleet's Metrics, holding the merged spans and counters of all accounts, and the
+	result of every account.
+	"""
+	accounts = load_manifest(manifest_file)
+	argv = account_argv(argv, args)
+	providers_file = os.path.abspath('providers.tf')
+	logging.info(f'Running {len(accounts)} accounts, {args.fleet_workers} at a time, in {os.path.abspath(args.fleet_dir)}')
+	with ThreadPoolExecutor(max_workers=args.fleet_workers, thread_name_prefix='fleet') as executor:
+		results = list(executor.map(lambda account: run_account(account, argv, args.fleet_dir, providers_file,
+			init=not args.ids_only, offline=args.offline), accounts))
+
+	fleet_metrics = Metrics()
+	for result in results:
+		fleet_metrics.increment('fleet_accounts', status=result['status'])
+		if 'duration_seconds' in result:
+			fleet_metrics.observe('account_run', result['duration_seconds'], account=result['account_id'])
+		if result.get('report') is not None:
+			fleet_metrics.merge(result['report'])
+	return fleet_metrics, results
+
+
+def summarize(results):
+	"""
+	Returns the per-account part of the aggregated fleet report.
+	"""
+	summary = []
+	for result in results:
+		counters = {}
+		for counter in (result.get('report') or {}).get('counters', []):
+			counters[counter['name']] = counters.get(counter['name'], 0) + counter['value']
+		summary.append({
+			'account_id': result['account_id'],
+			'status': result['status'],
+			'directory': result['directory'],
+			'log': result['log'],
+			'returncode': result.get('returncode'),
+			'duration_seconds': result.get('duration_seconds'),
+			'error': result.get('error'),
+			'counters': counters
+		})
+	return summary
@@ -0,0 +1,265 @@
+import functools
+
+
+WRITE_CHUNK_SIZE = 1000
+
+
+def escape_string(value):
+	"""
+	Escape a value for use inside an HCL quoted string, including the ${ and %{
+	template sequences which terraform would otherwise interpolate.
+	"""
+	# Most values need no escaping, substring checks are much cheaper than a regex scan
+	if '"' in value or '\\' in value:
+		value = value.replace('\\', '\\\\').replace('"', '\\"')
+	if '\n' in value or '\r' in value or '\t' in value:
+		value = value.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+	if '{' in value:
+		value = value.replace('${', '$${').replace('%{', '%%{')
+	return value
+
+
+def escape_heredoc(value):
+	# Heredocs keep newlines and quotes literally but still interpolate templates
+	if '{' in value:
+		value = value.replace('${', '$${').replace('%{', '%%{')
+	return value
+
+
+def flatten(value):
+	# NRQL queries and descriptions are rendered on a single line
+	return value.strip().replace('\r\n', ' ').replace('\n', ' ')
+
+
+def format_number(value):
+	if value.__class__ is float and value.is_integer():
+		return str(int(value))
+	return str(value)
+
+
+def heredoc_delimiter(value):
+	delimiter = 'EOT'
+	while delimiter in value:
+		delimiter += '_'
+	return delimiter
+
+
+_DESCRIPTION = '  description = "{}"\n'.format
+_RUNBOOK_URL = '  runbook_url = "{}"\n'.format
+_TITLE_TEMPLATE = '  title_template = "{}"\n'.format
+_EXPIRATION_DURATION = '  expiration_duration = {}\n'.format
+_OPEN_VIOLATION_ON_EXPIRATION = '  open_violation_on_expiration = true\n'
+_CLOSE_VIOLATIONS_ON_EXPIRATION = '  close_violations_on_expiration = true\n'
+_IGNORE_ON_EXPECTED_TERMINATION = '  ignore_on_expected_termination = true\n'
+_AGGREGATION_DELAY = '  aggregation_delay = {}\n'.format
+_AGGREGATION_METHOD = '  aggregation_method = "{}"\n'.format
+_AGGREGATION_TIMER = '  aggregation_timer = {}\n'.format
+_AGGREGATION_WINDOW = '  aggregation_window = {}\n'.format
+_EVALUATION_DELAY = '  evaluation_delay = {}\n'.format
+_FILL_OPTION = '  fill_option = "{}"\n'.format
+_FILL_VALUE = '  fill_value = {}\n'.format
+_SLIDE_BY = '  slide_by = {}\n'.format
+
+
+# Terms, expiration and signal settings are immutable and the same few combinations
+# repeat across thousands of conditions, so each distinct one is rendered only once
+@functools.lru_cache(maxsize=4096)
+def render_term(term):
+	return (
+		f'  {term.priority.lower()} {{\n'
+		f'    operator = "{term.operator.lower()}"\n'
+		f'    threshold = {format_number(term.threshold)}\n'
+		f'    threshold_duration = {term.threshold_duration}\n'
+		f'    threshold_occurrences = "{term.threshold_occurrences.lower()}"\n'
+		f'  }}\n'
+	)
+
+
+@functools.lru_cache(maxsize=4096)
+def render_expiration(expiration):
+	# Optional settings are only written when set, like the provider's defaults
+	parts = []
+	if expiration.expiration_duration:
+		parts.append(_EXPIRATION_DURATION(format_number(expiration.expiration_duration)))
+	if expiration.open_violation_on_expiration:
+		parts.append(_OPEN_VIOLATION_ON_EXPIRATION)
+	if expiration.close_violations_on_expiration:
+		parts.append(_CLOSE_VIOLATIONS_ON_EXPIRATION)
+	if expiration.ignore_on_expected_termination:
+		parts.append(_IGNORE_ON_EXPECTED_TERMINATION)
+	return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=4096)
+def render_signal(signal):
+	parts = []
+	if signal.aggregation_delay:
+		parts.append(_AGGREGATION_DELAY(format_number(signal.aggregation_delay)))
+	if signal.aggregation_method:
+		parts.append(_AGGREGATION_METHOD(signal.aggregation_method.lower()))
+	if signal.aggregation_timer:
+		parts.append(_AGGREGATION_TIMER(format_number(signal.aggregation_timer)))
+	if signal.aggregation_window:
+		parts.append(_AGGREGATION_WINDOW(format_number(signal.aggregation_window)))
+	if signal.evaluation_delay:
+		parts.append(_EVALUATION_DELAY(format_number(signal.evaluation_delay)))
+	if signal.fill_option:
+		parts.append(_FILL_OPTION(signal.fill_option.lower()))
+	if signal.fill_value:
+		parts.append(_FILL_VALUE(format_number(signal.fill_value)))
+	if signal.slide_by:
+		parts.append(_SLIDE_BY(format_number(signal.slide_by)))
+	return ''.join(parts)
+
+
+def reference(address):
+	# Refers to another resource managed in the same configuration by its address
+	return address + '.id'
+
+
+def render_condition(entity, resource_name, policy_address=None):
+	policy_id = reference(policy_address) if policy_address else entity.policy_id
+	parts = [
+		f'resource "newrelic_nrql_alert_condition" "{resource_name}" {{\n'
+		f'  policy_id = {policy_id}\n'
+		f'  type = "{entity.type.lower()}"\n'
+		f'  name = "{escape_string(entity.name)}"\n'
+		f'  enabled = {"true" if entity.enabled else "false"}\n'
+		f'  violation_time_limit_seconds = {entity.violation_time_limit_seconds}\n'
+		f'  nrql {{\n'
+		f'    query = "{escape_string(flatten(entity.query))}"\n'
+		f'  }}\n'
+	]
+	if entity.description:
+		parts.append(_DESCRIPTION(escape_string(flatten(entity.description))))
+	if entity.runbook_url:
+		parts.append(_RUNBOOK_URL(escape_string(entity.runbook_url)))
+	if entity.title_template:
+		parts.append(_TITLE_TEMPLATE(escape_string(entity.title_template)))
+
+	for term in entity.terms:
+		parts.append(render_term(term))
+	if entity.expiration is not None:
+		parts.append(render_expiration(entity.expiration))
+	if entity.signal is not None:
+		parts.append(render_signal(entity.signal))
+
+	parts.append('}\n\n')
+	return ''.join(parts)
+
+
+_CHANNEL_HEADER = (
+	'resource "newrelic_notification_channel" "{}" {{\n'
+	'  name = "{}"\n'
+	'  type = "{}"\n'
+	'  destination_id = {}\n'
+	'  product = "{}"\n'
+).format
+_CHANNEL_PROPERTY = (
+	'  property {{\n'
+	'    key = "{}"\n'
+	'    value = "{}"\n'
+	'  }}\n\n'
+).format
+_CHANNEL_HEREDOC_PROPERTY = (
+	'  property {{\n'
+	'    key = "{}"\n'
+	'    value = <<{}\n{}\n{}\n\n'
+	'  }}\n\n'
+).format
+
+
+def render_channel(entity, resource_name, destination_address=None):
+	parts = [_CHANNEL_HEADER(
+		resource_name,
+		escape_string(entity.name),
+		escape_string(entity.type),
+		reference(destination_address) if destination_address else f'"{escape_string(entity.destination_id)}"',
+		escape_string(entity.product)
+	)]
+	for prop in entity.properties:
+		value = prop.value
+		if '\n' in value:
+			delimiter = heredoc_delimiter(value)
+			parts.append(_CHANNEL_HEREDOC_PROPERTY(escape_string(prop.key), delimiter, escape_heredoc(value), delimiter))
+		else:
+			parts.append(_CHANNEL_PROPERTY(escape_string(prop.key), escape_string(value)))
+	parts.append('}\n\n')
+	return ''.join(parts)
+
+
+_DESTINATION_HEADER = (
+	'resource "newrelic_notification_destination" "{}" {{\n'
+	'  name = "{}"\n'
+	'  type = "{}"\n'
+).format
+_DESTINATION_AUTH_TOKEN = (
+	'  auth_token {{\n'
+	'    prefix = "{}"\n'
+	'  }}\n'
+).format
+_DESTINATION_PROPERTY = (
+	'  property {{\n'
+	'    key = "{}"\n'
+	'    value = "{}"\n'
+	'  }}\n'
+).format
+_DESTINATION_DISPLAY_PROPERTY = (
+	'  property {{\n'
+	'    display_value = "{}"\n'
+	'    key = "{}"\n'
+	'    value = "{}"\n'
+	'  }}\n'
+).format
+_DESTINATION_DEFAULT_PROPERTY = '  property {\n    key = "migrated_tf"\n    value = "terraform_tf"\n  }\n'
+
+
+def render_destination(entity, resource_name):
+	parts = [_DESTINATION_HEADER(resource_name, escape_string(entity.name), escape_string(entity.type))]
+	if entity.auth:
+		parts.append(_DESTINATION_AUTH_TOKEN(escape_string(entity.auth.prefix or '')))
+	for prop in entity.properties:
+		if prop.display_value:
+			parts.append(_DESTINATION_DISPLAY_PROPERTY(
+				escape_string(prop.display_value), escape_string(prop.key), escape_string(prop.value)))
+		else:
+			parts.append(_DESTINATION_PROPERTY(escape_string(prop.key), escape_string(prop.value)))
+	if not entity.properties:
+		parts.append(_DESTINATION_DEFAULT_PROPERTY)
+	parts.append('}\n\n')
+	return ''.join(parts)
+
+
+_POLICY = (
+	'resource "newrelic_alert_policy" "{}" {{\n'
+	'  name = "{}"\n'
+	'  incident_preference = "{}"\n'
+	'}}\n\n'
+).format
+
+
+def render_policy(entity, resource_name):
+	return _POLICY(resource_name, escape_string(entity.name), escape_string(entity.incident_preference))
+
+
+def write_blocks(tf_file, blocks, chunk_size=WRITE_CHUNK_SIZE, separator=''):
+	"""
+	Write rendered blocks to tf_file, joining them into one write per chunk.
+	`separator` is written between blocks. Returns the number of blocks written.
+	"""
+	count = 0
+	chunk = []
+	for block in blocks:
+		chunk.append(block)
+		if len(chunk) >= chunk_size:
+			if count and separator:
+				tf_file.write(separator)
+			tf_file.write(separator.join(chunk))
+			count += len(chunk)
+			chunk = []
+	if chunk:
+		if count and separator:
+			tf_file.write(separator)
+		tf_file.write(separator.join(chunk))
+		count += len(chunk)
+	return count
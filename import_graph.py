@@ -0,0 +1,63 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class AddressIndex:
+	"""
+	Terraform address of every resource rendered in a run, by resource type and ID,
+	so references between resources can be rendered as <address>.id in O(1).
+	"""
+	def __init__(self):
+		self.addresses = {}
+
+	def add(self, resource_handler, resources):
+		for resource in resources:
+			self.addresses[(resource_handler.resource_type, str(resource.id))] = resource_handler.get_resource_address(resource)
+
+	def get(self, resource_type, resource_id):
+		return self.addresses.get((resource_type, str(resource_id)))
+
+	def __len__(self):
+		return len(self.addresses)
+
+
+def dependency_graph(resource_handlers):
+	"""
+	Returns resource_type -> the resource types of the run it references, which have
+	to be in the terraform state before it is imported.
+	"""
+	resource_types = set(resource_handler.resource_type for resource_handler in resource_handlers)
+	return {resource_handler.resource_type: [dependency for dependency in resource_handler.depends_on
+		if dependency in resource_types] for resource_handler in resource_handlers}
+
+
+def run_stages(resource_handlers, stage, max_workers=2):
+	"""
+	Call stage(resource_handler) for every handler in a thread pool, each as soon as
+	the stages of the resource types it depends on finished, so independent branches
+	(destinations -> channels, policies -> conditions) run next to each other.
+	A failing stage is logged and does not hold back the stages depending on it,
+	they are imported with the references as far as those made it into the state.
+	Returns resource_type -> the exception its stage failed with, or None.
+	"""
+	handlers = {resource_handler.resource_type: resource_handler for resource_handler in resource_handlers}
+	waiting = dependency_graph(resource_handlers)
+	results = {}
+	running = {}
+	with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='import-stage') as executor:
+		while waiting or running:
+			# Submitted only once their dependencies are done, a queued stage never waits on a worker
+			for resource_type in [resource_type for resource_type, dependencies in waiting.items()
+					if all(dependency in results for dependency in dependencies)]:
+				del waiting[resource_type]
+				logging.info(f'Starting import stage {resource_type}')
+				running[executor.submit(stage, handlers[resource_type])] = resource_type
+			if not running:
+				raise ValueError(f'Circular dependency between {", ".join(waiting)}')
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in done:
+				resource_type = running.pop(future)
+				results[resource_type] = future.exception()
+				if results[resource_type] is not None:
+					logging.error(f'Import stage {resource_type} failed: {results[resource_type]}')
+	return results
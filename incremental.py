@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from json_renderer import dumps
+from newrelic_resource import HCL_FORMAT, JSON_FORMAT
+from snapshot import open_snapshot
+
+
+RESOURCE_HEADER = re.compile(r'^resource "([^"]+)" "([^"]+)" \{', re.MULTILINE)
+
+
+class SnapshotDiff:
+	"""
+	Result of comparing fetched entities against the previous run's snapshot.
+	"""
+	def __init__(self):
+		self.added = []
+		self.changed = []
+		self.unchanged = []
+		self.removed = []
+
+	def __repr__(self):
+		return (f'SnapshotDiff(added={len(self.added)}, changed={len(self.changed)}, '
+			f'unchanged={len(self.unchanged)}, removed={len(self.removed)})')
+
+
+def entity_hash(entity):
+	"""
+	Hash of the entity's normalized payload, independent of key order and whitespace.
+	Accepts a model or the dict a snapshot stores for it.
+	"""
+	if not isinstance(entity, dict):
+		entity = entity.to_dict()
+	payload = json.dumps(entity, sort_keys=True, separators=(',', ':'))
+	return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LegacySnapshot:
+	"""
+	A snapshot of an earlier version, one indented JSON list, loaded whole and read
+	through the same interface as snapshot.Snapshot.
+	"""
+	def __init__(self, entities):
+		self.entities = {entity['id']: entity for entity in entities}
+
+	def __len__(self):
+		return len(self.entities)
+
+	def __contains__(self, entity_id):
+		return entity_id in self.entities
+
+	def ids(self):
+		return self.entities.keys()
+
+	def hash(self, entity_id):
+		return entity_hash(self.entities[entity_id])
+
+	def get(self, entity_id):
+		return self.entities.get(entity_id)
+
+	def close(self):
+		pass
+
+
+def load_snapshot(base):
+	"""
+	Returns the previous run's snapshot written for `base`, or None when there is none.
+	"""
+	snapshot = open_snapshot(base)
+	if snapshot is not None:
+		return snapshot
+	try:
+		with open(base + '.json') as f:
+			return LegacySnapshot(json.load(f))
+	except FileNotFoundError:
+		return None
+	except ValueError as e:
+		logging.warning(f'Ignoring unreadable snapshot {base}.json: {e}')
+		return None
+
+
+def diff_entities(previous, entities):
+	"""
+	Classify entities as added, changed or unchanged against the previous snapshot,
+	comparing against the hashes in its index. Previous entities that were not
+	fetched again are reported as removed, as the raw snapshot dicts.
+	"""
+	diff = SnapshotDiff()
+	seen = set()
+	for entity in entities:
+		seen.add(entity.id)
+		if entity.id not in previous:
+			diff.added.append(entity)
+		elif previous.hash(entity.id) != entity_hash(entity):
+			diff.changed.append(entity)
+		else:
+			diff.unchanged.append(entity)
+	diff.removed = [previous.get(entity_id) for entity_id in previous.ids() if entity_id not in seen]
+	return diff
+
+
+def read_resource_blocks(filename):
+	"""
+	Split a generated .tf file into {address: block text}, each block running up to the next resource header.
+	Generated .tf.json files are split into the members of their resource objects.
+	"""
+	try:
+		with open(filename) as f:
+			text = f.read()
+	except FileNotFoundError:
+		return {}
+	if text.lstrip().startswith('{'):
+		return {f'{resource_type}.{name}': dumps(name) + ':' + dumps(config)
+			for resource_type, resources in json.loads(text).get('resource', {}).items()
+			for name, config in resources.items()}
+	headers = list(RESOURCE_HEADER.finditer(text))
+	blocks = {}
+	for index, match in enumerate(headers):
+		end = headers[index + 1].start() if index + 1 < len(headers) else len(text)
+		blocks[f'{match.group(1)}.{match.group(2)}'] = text[match.start():end]
+	return blocks
+
+
+def incremental_update(resource_handler, entities, snapshot_base):
+	"""
+	Re-render only the entities that are new or changed since the previous snapshot and
+	splice them into the existing configuration, keeping unchanged blocks as they are.
+	Entities that disappeared are flagged but their configuration is left for review.
+	Returns the SnapshotDiff, or None when there is no previous snapshot to compare with.
+	"""
+	previous = load_snapshot(snapshot_base)
+	if previous is None:
+		return None
+	try:
+		return _incremental_update(resource_handler, entities, previous)
+	finally:
+		previous.close()
+
+
+def _incremental_update(resource_handler, entities, previous):
+	diff = diff_entities(previous, entities)
+	# address -> file of every existing block, the configuration may be sharded over several files
+	existing_blocks = {}
+	block_files = {}
+	for config_filename in resource_handler.get_config_filenames():
+		for address, block in read_resource_blocks(config_filename).items():
+			existing_blocks[address] = block
+			block_files[address] = config_filename
+
+	# Unchanged entities whose block went missing, or belongs in another file since the
+	# layout or format changed, are rendered again
+	stale = [entity for entity in diff.unchanged if block_files.get(resource_handler.get_resource_address(entity))
+		!= resource_handler.get_entity_config_filename(entity)]
+	to_render = diff.added + diff.changed + stale
+
+	logging.info(f'{resource_handler.resource_type}: {diff}, re-rendering {len(to_render)}')
+	for entity in diff.removed:
+		address = resource_handler.get_resource_address(resource_handler.parse_entity(entity))
+		logging.warning(f"{resource_handler.resource_type} with ID {entity['id']} was removed from New Relic, "
+			f"its configuration {address} was kept for review")
+
+	if not to_render:
+		return diff
+
+	fd, rendered_filename = tempfile.mkstemp(dir='.', suffix='.partial')
+	os.close(fd)
+	try:
+		resource_handler.create_terraform_config(to_render, filename=rendered_filename)
+		rendered_blocks = read_resource_blocks(rendered_filename)
+	finally:
+		os.remove(rendered_filename)
+
+	# A renamed entity moves to a new address, its old block must not linger as a duplicate
+	replaced_addresses = set()
+	for entity in diff.changed:
+		old_address = resource_handler.get_resource_address(resource_handler.parse_entity(previous.get(entity.id)))
+		if old_address != resource_handler.get_resource_address(entity):
+			replaced_addresses.add(old_address)
+			logging.warning(f"{resource_handler.resource_type} with ID {entity.id} was renamed, "
+				f"its address moved from {old_address}, move it in the terraform state")
+
+	# Entities go to the file of their shard, blocks of removed entities stay where they were
+	files = {}
+	for entity in entities:
+		address = resource_handler.get_resource_address(entity)
+		replaced_addresses.add(address)
+		files.setdefault(resource_handler.get_entity_config_filename(entity), []).append(
+			rendered_blocks.get(address) or existing_blocks[address])
+	for address, block in existing_blocks.items():
+		if address not in replaced_addresses:
+			files.setdefault(block_files[address], []).append(block)
+	for config_filename, blocks in files.items():
+		fd, tmp_path = tempfile.mkstemp(dir='.', suffix='.tf.tmp')
+		with os.fdopen(fd, 'w') as tf_file:
+			# A file of removed entities' blocks may still be in the other format
+			resource_handler.write_config_blocks(tf_file, blocks,
+				output_format=JSON_FORMAT if config_filename.endswith('.json') else HCL_FORMAT)
+		os.replace(tmp_path, config_filename)
+	resource_handler.remove_stale_config(files)
+	return diff
@@ -0,0 +1,141 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRIC_PREFIX = 'newrelic_importer_'
+
+
+class Metrics:
+	"""
+	Timed spans and counters for one importer run, keyed by name and labels.
+	Safe to update from the prefetch thread and from asyncio tasks.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.started_at = time.time()
+		self.start = time.perf_counter()
+		# (name, labels) -> [count, total_seconds, max_seconds]
+		self.spans = {}
+		# (name, labels) -> value
+		self.counters = {}
+
+	@contextmanager
+	def span(self, name, **labels):
+		"""
+		Time the enclosed block. Concurrent spans of the same name add up, so their
+		total can exceed the wall-clock time of the run.
+		"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - start, **labels)
+
+	def observe(self, name, seconds, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			stats = self.spans.setdefault(key, [0, 0.0, 0.0])
+			stats[0] += 1
+			stats[1] += seconds
+			stats[2] = max(stats[2], seconds)
+
+	def increment(self, name, value=1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def merge(self, report):
+		"""
+		Add the spans and counters of another run's report(), e.g. of a fleet worker.
+		"""
+		with self.lock:
+			for span in report['spans']:
+				key = (span['name'], tuple(sorted(span['labels'].items())))
+				stats = self.spans.setdefault(key, [0, 0.0, 0.0])
+				stats[0] += span['count']
+				stats[1] += span['total_seconds']
+				stats[2] = max(stats[2], span['max_seconds'])
+			for counter in report['counters']:
+				key = (counter['name'], tuple(sorted(counter['labels'].items())))
+				self.counters[key] = self.counters.get(key, 0) + counter['value']
+
+	def report(self):
+		"""
+		Returns the run as a JSON serializable dict.
+		"""
+		with self.lock:
+			spans = [{'name': name, 'labels': dict(labels), 'count': count, 'total_seconds': total, 'max_seconds': longest}
+				for (name, labels), (count, total, longest) in sorted(self.spans.items())]
+			counters = [{'name': name, 'labels': dict(labels), 'value': value}
+				for (name, labels), value in sorted(self.counters.items())]
+		return {
+			'started_at': self.started_at,
+			'duration_seconds': time.perf_counter() - self.start,
+			'spans': spans,
+			'counters': counters
+		}
+
+	def write_report(self, filename, **extra):
+		# extra adds top level fields, e.g. the accounts of a fleet run
+		_write_atomic(filename, json.dumps({**self.report(), **extra}, indent=4))
+
+	def write_prometheus(self, filename):
+		"""
+		Write the metrics in the Prometheus text format, for node_exporter's textfile collector.
+		"""
+		report = self.report()
+		# name -> (type, samples); every sample of a family has to follow its TYPE line
+		families = {}
+
+		def add(name, metric_type, labels, value):
+			name = METRIC_PREFIX + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+			samples = families.setdefault(name, (metric_type, []))[1]
+			label_text = ','.join(f'{key}="{_escape_label(str(label))}"' for key, label in labels.items())
+			samples.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+
+		add('run_duration_seconds', 'gauge', {}, report['duration_seconds'])
+		add('run_started_timestamp_seconds', 'gauge', {}, report['started_at'])
+		for span in report['spans']:
+			add(span['name'] + '_seconds_total', 'counter', span['labels'], span['total_seconds'])
+			add(span['name'] + '_count', 'counter', span['labels'], span['count'])
+			add(span['name'] + '_max_seconds', 'gauge', span['labels'], span['max_seconds'])
+		for counter in report['counters']:
+			add(counter['name'] + '_total', 'counter', counter['labels'], counter['value'])
+		lines = []
+		for name, (metric_type, samples) in families.items():
+			lines.append(f'# TYPE {name} {metric_type}')
+			lines.extend(samples)
+		_write_atomic(filename, '\n'.join(lines) + '\n')
+
+	def summary(self):
+		"""
+		Returns one line per span name with its call count and total time, for the log.
+		"""
+		totals = {}
+		for span in self.report()['spans']:
+			count, total = totals.get(span['name'], (0, 0.0))
+			totals[span['name']] = (count + span['count'], total + span['total_seconds'])
+		return [f'{name}: {count} calls, {total:.3f}s' for name, (count, total) in totals.items()]
+
+
+def _escape_label(value):
+	return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _write_atomic(filename, text):
+	# Collectors may read the file at any time, never let them see a partial one
+	fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+	with os.fdopen(fd, 'w') as f:
+		f.write(text)
+	os.replace(tmp_path, filename)
+
+
+# The run's metrics, shared by every module
+metrics = Metrics()
+span = metrics.span
+increment = metrics.increment
@@ -0,0 +1,152 @@
+import functools
+import json
+from hcl_renderer import flatten
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+
+# Resources of one type are written as members of a single object, one per line
+MEMBER_SEPARATOR = ',\n'
+JSON_FOOTER = '\n}}}\n'
+
+
+def dumps(value):
+	if orjson is not None:
+		return orjson.dumps(value).decode()
+	return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def json_header(resource_type):
+	return '{"resource":{' + dumps(resource_type) + ':{\n'
+
+
+def escape_template(value):
+	# JSON strings are still terraform templates, only ${ and %{ need escaping
+	if '{' in value:
+		value = value.replace('${', '$${').replace('%{', '%%{')
+	return value
+
+
+def reference(address):
+	return '${' + address + '.id}'
+
+
+def number(value):
+	if value.__class__ is float and value.is_integer():
+		return int(value)
+	return value
+
+
+def render_member(resource_name, config):
+	"""
+	Returns the "<resource_name>": {...} member of one resource in the .tf.json resource object.
+	"""
+	return dumps(resource_name) + ':' + dumps(config)
+
+
+# Like the HCL renderer, each distinct term, expiration and signal is converted once.
+# The cached dicts are shared between conditions and must not be modified
+@functools.lru_cache(maxsize=4096)
+def term_config(term):
+	return {
+		'operator': term.operator.lower(),
+		'threshold': number(term.threshold),
+		'threshold_duration': term.threshold_duration,
+		'threshold_occurrences': term.threshold_occurrences.lower()
+	}
+
+
+@functools.lru_cache(maxsize=4096)
+def expiration_config(expiration):
+	# Optional settings are only written when set, like the provider's defaults
+	config = {}
+	if expiration.expiration_duration:
+		config['expiration_duration'] = number(expiration.expiration_duration)
+	if expiration.open_violation_on_expiration:
+		config['open_violation_on_expiration'] = True
+	if expiration.close_violations_on_expiration:
+		config['close_violations_on_expiration'] = True
+	if expiration.ignore_on_expected_termination:
+		config['ignore_on_expected_termination'] = True
+	return config
+
+
+@functools.lru_cache(maxsize=4096)
+def signal_config(signal):
+	config = {}
+	if signal.aggregation_delay:
+		config['aggregation_delay'] = number(signal.aggregation_delay)
+	if signal.aggregation_method:
+		config['aggregation_method'] = signal.aggregation_method.lower()
+	if signal.aggregation_timer:
+		config['aggregation_timer'] = number(signal.aggregation_timer)
+	if signal.aggregation_window:
+		config['aggregation_window'] = number(signal.aggregation_window)
+	if signal.evaluation_delay:
+		config['evaluation_delay'] = number(signal.evaluation_delay)
+	if signal.fill_option:
+		config['fill_option'] = signal.fill_option.lower()
+	if signal.fill_value:
+		config['fill_value'] = number(signal.fill_value)
+	if signal.slide_by:
+		config['slide_by'] = number(signal.slide_by)
+	return config
+
+
+def condition_config(entity, policy_address=None):
+	# Queries and descriptions are flattened like in HCL, switching formats changes no attribute
+	config = {
+		'policy_id': reference(policy_address) if policy_address else entity.policy_id,
+		'type': entity.type.lower(),
+		'name': escape_template(entity.name),
+		'enabled': entity.enabled,
+		'violation_time_limit_seconds': entity.violation_time_limit_seconds,
+		'nrql': {'query': escape_template(flatten(entity.query))}
+	}
+	if entity.description:
+		config['description'] = escape_template(flatten(entity.description))
+	if entity.runbook_url:
+		config['runbook_url'] = escape_template(entity.runbook_url)
+	if entity.title_template:
+		config['title_template'] = escape_template(entity.title_template)
+
+	for term in entity.terms:
+		config.setdefault(term.priority.lower(), []).append(term_config(term))
+	if entity.expiration is not None:
+		config.update(expiration_config(entity.expiration))
+	if entity.signal is not None:
+		config.update(signal_config(entity.signal))
+	return config
+
+
+def channel_config(entity, destination_address=None):
+	# Multi-line property values are plain JSON strings, no heredocs needed
+	return {
+		'name': escape_template(entity.name),
+		'type': escape_template(entity.type),
+		'destination_id': reference(destination_address) if destination_address else escape_template(entity.destination_id),
+		'product': escape_template(entity.product),
+		'property': [{'key': escape_template(prop.key), 'value': escape_template(prop.value)} for prop in entity.properties]
+	}
+
+
+def destination_config(entity):
+	config = {'name': escape_template(entity.name), 'type': escape_template(entity.type)}
+	if entity.auth:
+		config['auth_token'] = {'prefix': escape_template(entity.auth.prefix or '')}
+	properties = []
+	for prop in entity.properties:
+		if prop.display_value:
+			properties.append({'display_value': escape_template(prop.display_value), 'key': escape_template(prop.key),
+				'value': escape_template(prop.value)})
+		else:
+			properties.append({'key': escape_template(prop.key), 'value': escape_template(prop.value)})
+	config['property'] = properties or [{'key': 'migrated_tf', 'value': 'terraform_tf'}]
+	return config
+
+
+def policy_config(entity):
+	return {'name': escape_template(entity.name), 'incident_preference': escape_template(entity.incident_preference)}
@@ -1,68 +1,630 @@
+import argparse
+import itertools
 import sys
 import os
+import re
+import signal
 import logging
+import threading
 import time
 import json
+from async_fetch import fetch_all, is_fetch_error
+from batch_fetch import fetch_accounts
+from channel_resource import ChannelResource
+from checkpoint import DEFAULT_CHECKPOINT_DIR, Checkpoint
+from concurrency import AIMDController
 from condition_resource import ConditionResource
+from config_validator import ConfigValidationError, load_provider_schema, validate_config
+from destination_resource import DestinationResource
+from drift_watch import DEFAULT_EVENTS_FILE, DEFAULT_PATCH_DIR, DEFAULT_WATCH_INTERVAL, DriftWatcher
+from filters import load_condition_filter
+from fleet import run_fleet, summarize
+from import_graph import AddressIndex, run_stages
+from incremental import incremental_update
+from instrumentation import metrics
+from models import ModelError
+from name_allocator import DEFAULT_NAMES_FILE, NameAllocator
+from nerdgraph_client import NERDGRAPH_URL, NerdGraphClient, NerdGraphError
+from newrelic_resource import HCL_FORMAT, OUTPUT_FORMATS
+from pipeline import prefetch
+from policy_resource import PolicyResource
+from query_builder import FULL_FIELDS, SUMMARY_FIELDS
+from terraform_state import load_state_index
+from response_cache import DEFAULT_CACHE_DIR, ResponseCache
+from snapshot import COMPRESSIONS, SnapshotWriter, compression_available
+from utils import prepare_root_module, working_directory
 from dotenv import load_dotenv
+import requests
 
 
 load_dotenv() # Load environment variables from the .env file
 logging.basicConfig(level=logging.INFO)
+logging.getLogger('httpx').setLevel(logging.WARNING)
 
-def main(resource_type, num_resources, account_id, api_key):
-	# Create the appropriate resource handler
-	resource_classes = {
-		'newrelic_nrql_alert_condition': ConditionResource
+# Ordered so that resources are imported after the ones they reference
+RESOURCE_CLASSES = {
+	'newrelic_notification_destination': DestinationResource,
+	'newrelic_notification_channel': ChannelResource,
+	'newrelic_alert_policy': PolicyResource,
+	'newrelic_nrql_alert_condition': ConditionResource
+}
+# NerdGraph requests in flight at the start of a run, adapted from there within --min/--max-in-flight
+DEFAULT_IN_FLIGHT = 4
+
+def main(args, account_id, api_key, client=None):
+	"""
+	Export the resources of the account(s). Returns False when the run failed, with
+	invalid options, failed fetches or configuration rejected by the validation.
+	"""
+	num_resources = args.num_resources
+	if num_resources != 'all':
+		try:
+			num_resources = int(num_resources)
+		except ValueError:
+			logging.error("Invalid number of resources specified. Please provide an integer or 'all'.")
+			return False
+
+	if args.watch and (args.offline or args.ids_only):
+		logging.error('--watch polls New Relic for full entities, it can not be combined with --offline or --ids-only')
+		return False
+
+	cache = None
+	# Cached responses would hide the drift the watch is looking for
+	if (args.cache_dir or args.offline) and not args.watch:
+		cache = ResponseCache(args.cache_dir or DEFAULT_CACHE_DIR, ttl=args.cache_ttl,
+			max_bytes=args.cache_max_mb * 1024 * 1024, offline=args.offline)
+
+	# One controller per backend adapts the requests and terraform processes in flight to what it can take
+	try:
+		nerdgraph_concurrency = AIMDController('nerdgraph', args.max_in_flight, args.min_in_flight,
+			initial=min(DEFAULT_IN_FLIGHT, args.max_in_flight))
+		args.import_concurrency = AIMDController('terraform', args.import_workers, initial=1) if args.import_workers > 1 else None
+	except ValueError as e:
+		logging.error(e)
+		return False
+
+	client_options = {
+		'base_url': args.nerdgraph_url,
+		'connect_timeout': args.connect_timeout,
+		'read_timeout': args.read_timeout,
+		'max_retries': args.max_retries,
+		'cache': cache,
+		'concurrency': nerdgraph_concurrency
 	}
+	client = client or NerdGraphClient(api_key, **client_options)
+
+	if args.types:
+		resource_types = list(RESOURCE_CLASSES) if args.types == 'all' else args.types.split(',')
+	elif args.resource_type:
+		resource_types = [args.resource_type]
+	else:
+		logging.error("Specify a resource_type or --types.")
+		return False
+
+	for resource_type in resource_types:
+		if resource_type not in RESOURCE_CLASSES:
+			logging.error(f"Unsupported resource type: {resource_type}")
+			return False
+
+	if not compression_available(args.snapshot_compression):
+		logging.error(f'{args.snapshot_compression} snapshots need the zstandard package: pip install zstandard')
+		return False
+
+	try:
+		args.condition_filter = load_condition_filter(args.filter_config, args.policy_ids, args.include_name,
+			args.exclude_name, args.enabled_only)
+	except (OSError, ValueError, re.error) as e:
+		logging.error(f'Invalid condition filters: {e}')
+		return False
+
+	# Generated configuration is checked against the provider schema before anything is imported
+	args.resource_schemas = None
+	if not (args.skip_validation or args.ids_only or args.watch):
+		try:
+			args.resource_schemas = load_provider_schema(args.provider_schema)
+		except (OSError, ValueError, KeyError) as e:
+			logging.error(f'Invalid provider schema: {e}')
+			return False
+
+	account_ids = [account.strip() for account in account_id.split(',') if account.strip()]
+	if len(account_ids) > 1 and args.watch:
+		logging.error('--watch watches a single account, run one per account')
+		return False
+
+	# Resource names are allocated once for all resource types and kept stable across runs.
+	# The path is absolute since account and shard directories are entered along the way
+	args.name_allocator = NameAllocator(os.path.abspath(args.names_file))
+	if len(account_ids) > 1:
+		try:
+			return process_accounts(args, resource_types, account_ids, api_key, client, num_resources)
+		finally:
+			save_names(args)
+
+	# Create the appropriate resource handlers
+	resource_handlers = [create_handler(args, resource_type, account_id, api_key, client) for resource_type in resource_types]
+
+	if args.watch:
+		watch(args, resource_handlers)
+		return True
+
+	state_index = load_state(args, resource_handlers)
+
+	# Fetched pages and imports are recorded so an interrupted run can continue with --resume
+	checkpoint = None if args.ids_only else Checkpoint(args.checkpoint_dir, resume=args.resume)
+	completed = False
+	try:
+		completed = export_resources(args, resource_handlers, api_key, client_options, num_resources, state_index,
+			checkpoint)
+	finally:
+		save_names(args)
+		if checkpoint is not None:
+			checkpoint.close(completed)
+			if not completed:
+				logging.info(f'Progress saved in {args.checkpoint_dir}, continue with --resume')
+	return completed
+
+def load_state(args, resource_handlers):
+	"""
+	Read the terraform state of the current directory once, so already managed resources
+	are never imported again. None when the handlers do not import into this state: with
+	--skip-state-check, or when they are all exported to shard directories.
+	"""
+	if args.skip_state_check or all(exports_to_shards(args, resource_handler) for resource_handler in resource_handlers):
+		return None
+	return load_state_index(args.state_file)
+
+def save_names(args):
+	# Written whenever configuration may have been, an ID-only run writes none
+	if not args.ids_only:
+		args.name_allocator.save()
+
+def export_resources(args, resource_handlers, api_key, client_options, num_resources, state_index, checkpoint):
+	"""
+	Fetch, render and import every handler's resources.
+	Returns False when fetching any of them failed.
+	"""
+	if len(resource_handlers) == 1:
+		resource_handler = resource_handlers[0]
+		resources = []
+		pages = None
+		if checkpoint is not None:
+			resources = checkpoint.replay(resource_handler)
+		if checkpoint is None or not checkpoint.fetch_complete(resource_handler):
+			# Pages are downloaded in a background thread while earlier pages are rendered
+			cursor = checkpoint.start_cursor(resource_handler) if checkpoint is not None else None
+			page_iterator = resource_handler.iter_pages(cursor)
+			if checkpoint is not None:
+				page_iterator = checkpoint.record_pages(resource_handler, page_iterator)
+			pages = prefetch(page_iterator, maxsize=args.prefetch_pages)
+			resources = itertools.chain(resources, (entity for entities, _ in pages for entity in entities))
+		try:
+			export_type(args, resource_handler, resources, num_resources, state_index, checkpoint)
+			return True
+		except (requests.exceptions.RequestException, NerdGraphError) as e:
+			logging.error(f'Error fetching resources: {e}')
+		except KeyError as e:
+			logging.error(f'KeyError: {e} in NerdGraph response')
+		except ModelError as e:
+			logging.error(f'Unexpected NerdGraph response: {e}')
+		except ConfigValidationError as e:
+			logging.error(f'Nothing imported, {e}')
+		finally:
+			if pages is not None:
+				pages.close()
+		return False
+
+	# Walk every cursor chain at the same time, then render everything and import it stage by stage
+	replayed = {}
+	to_fetch = resource_handlers
+	cursors = None
+	on_page = None
+	if checkpoint is not None:
+		replayed = {resource_handler.resource_type: checkpoint.replay(resource_handler)
+			for resource_handler in resource_handlers}
+		to_fetch = [resource_handler for resource_handler in resource_handlers
+			if not checkpoint.fetch_complete(resource_handler)]
+		cursors = {resource_handler.resource_type: checkpoint.start_cursor(resource_handler)
+			for resource_handler in to_fetch}
+		on_page = checkpoint.record_page
+	results = fetch_all(to_fetch, api_key, max_in_flight=args.max_in_flight, cursors=cursors, on_page=on_page,
+		min_in_flight=args.min_in_flight, **client_options) if to_fetch else {}
+	completed = True
+	fetched = {}
+	for resource_handler in resource_handlers:
+		result = results.get(resource_handler.resource_type, [])
+		if isinstance(result, Exception):
+			if not is_fetch_error(result):
+				raise result
+			logging.error(f'Error fetching {resource_handler.resource_type} resources: {result}')
+			completed = False
+			continue
+		resources = replayed.get(resource_handler.resource_type, []) + result
+		fetched[resource_handler] = resources if num_resources == 'all' else resources[:num_resources]
+
+	if args.shard_layout == 'directories':
+		# Shards are imported into states of their own, references between them can not be resolved
+		for resource_handler, resources in fetched.items():
+			try:
+				export_type(args, resource_handler, resources, 'all', state_index, checkpoint)
+			except ConfigValidationError as e:
+				logging.error(f'{resource_handler.resource_type} not imported, {e}')
+				completed = False
+		return completed
+
+	if args.ids_only:
+		for resource_handler, resources in fetched.items():
+			plan_imports(resource_handler, resources, state_index)
+		return completed
+
+	# References to resources rendered in this run are written as <address>.id
+	address_index = AddressIndex()
+	for resource_handler, resources in fetched.items():
+		address_index.add(resource_handler, resources)
+	to_import = {}
+	for resource_handler, resources in fetched.items():
+		resource_handler.address_index = address_index
+		to_import[resource_handler] = render_resources(resource_handler, resources, args.incremental,
+			args.snapshot_compression)
+	if args.resource_schemas is not None:
+		# Validated together, the configuration of every type references the others
+		try:
+			validate_config(list(to_import), args.resource_schemas)
+		except ConfigValidationError as e:
+			logging.error(f'Nothing imported, {e}')
+			return False
+
+	# Referenced resources are imported first, their configuration would otherwise be planned as new.
+	# Other resource types' configuration is already written, bulk imports only plan their own resources
+	def stage(resource_handler):
+		import_resources(resource_handler, to_import[resource_handler], args.bulk_import, state_index, checkpoint,
+			target=True)
+	failed = run_stages(list(to_import), stage, max_workers=args.max_parallel_stages)
+	return completed and not any(failed.values())
+
+def watch(args, resource_handlers):
+	"""
+	Report drift of the exported resources until interrupted, see drift_watch.py.
+	"""
+	watcher = DriftWatcher(resource_handlers, args.drift_events, args.drift_patch_dir)
+	stop = threading.Event()
+	signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+	def on_poll(events):
+		# Patches add resources under newly allocated names
+		save_names(args)
+		# A daemon's metrics are only useful while it runs, they are written after every poll
+		if args.prometheus_textfile:
+			metrics.write_prometheus(args.prometheus_textfile)
+	logging.info(f'Watching {", ".join(resource_handler.resource_type for resource_handler in resource_handlers)} '
+		f'for drift every {args.watch_interval}s, events in {args.drift_events}')
+	try:
+		watcher.run(args.watch_interval, args.watch_count, stop, on_poll)
+	except KeyboardInterrupt:
+		logging.info('Stopped watching')
+
+def create_handler(args, resource_type, account_id, api_key, client):
+	options = {'client': client, 'field_set': SUMMARY_FIELDS if args.ids_only else FULL_FIELDS,
+		'render_workers': args.render_workers, 'shard_files': args.shard_layout == 'files', 'output_format': args.output_format,
+		'import_concurrency': args.import_concurrency, 'name_allocator': args.name_allocator}
+	if resource_type == 'newrelic_nrql_alert_condition':
+		options['condition_filter'] = args.condition_filter
+	return RESOURCE_CLASSES[resource_type](resource_type, account_id, api_key, **options)
+
+def process_accounts(args, resource_types, account_ids, api_key, client, num_resources):
+	"""
+	Export several accounts, fetching every resource type for a batch of accounts per
+	NerdGraph request. Each account gets its own directory (and terraform state) under
+	--accounts-dir, named after its ID, with providers.tf copied in and initialized. Returns False when any account or resource
+	type failed to fetch or validate.
+	"""
+	completed = True
+	prepared = set()
+	state_indexes = {}
+	providers_file = os.path.abspath('providers.tf')
+	for resource_type in resource_types:
+		resource_handlers = {account: create_handler(args, resource_type, account, api_key, client) for account in account_ids}
+		try:
+			results = fetch_accounts(resource_handlers, client, batch_size=args.account_batch_size)
+		except (requests.exceptions.RequestException, NerdGraphError) as e:
+			logging.error(f'Error fetching {resource_type} resources: {e}')
+			completed = False
+			continue
+		for account, result in results.items():
+			if isinstance(result, Exception):
+				logging.error(f'Error fetching {resource_type} resources of account {account}: {result}')
+				completed = False
+				continue
+			with working_directory(os.path.join(args.accounts_dir, account)):
+				if account not in prepared:
+					prepare_root_module(os.getcwd(), providers_file, init=not args.ids_only)
+					prepared.add(account)
+				if state_indexes.get(account) is None:
+					state_indexes[account] = load_state(args, [resource_handlers[account]])
+				try:
+					export_type(args, resource_handlers[account], result, num_resources, state_indexes[account])
+				except ConfigValidationError as e:
+					logging.error(f'{resource_type} of account {account} not imported, {e}')
+					completed = False
+	return completed
+
+def export_type(args, resource_handler, resources, num_resources, state_index, checkpoint=None):
+	"""
+	Export the resources of one handler into the current directory, or with
+	--shard-layout directories into one directory per shard.
+	"""
+	if exports_to_shards(args, resource_handler):
+		process_shards(args, resource_handler, resources, num_resources, checkpoint)
+	else:
+		process_resources(resource_handler, resources, num_resources, args.bulk_import, args.incremental,
+			state_index, checkpoint, args.snapshot_compression, args.resource_schemas)
 
-	if resource_type not in resource_classes:
-		logging.error(f"Unsupported resource type: {resource_type}")
+def exports_to_shards(args, resource_handler):
+	# Shard directories have terraform states of their own, process_shards reads them
+	return args.shard_layout == 'directories' and resource_handler.shard_attribute is not None
+
+def process_shards(args, resource_handler, resources, num_resources, checkpoint=None):
+	"""
+	Export the resources of one handler into a terraform root of its own per shard,
+	<shards-dir>/<resource_type>/<shard>, each with its own configuration, snapshot
+	and state, so a slice of the account can be planned and applied on its own.
+	Resources without a shard are exported to the current directory.
+	"""
+	resource_type = resource_handler.resource_type
+	if num_resources != 'all':
+		resources = itertools.islice(resources, num_resources)
+	shards = {}
+	for resource in resources:
+		shards.setdefault(resource_handler.get_shard(resource), []).append(resource)
+	providers_file = os.path.abspath('providers.tf')
+	for shard, shard_resources in shards.items():
+		directory = '.' if shard is None else os.path.join(args.shards_dir, resource_type, shard)
+		with working_directory(directory):
+			if shard is not None:
+				prepare_root_module(os.getcwd(), providers_file, init=not args.ids_only)
+			state_index = None if args.skip_state_check else load_state_index(args.state_file)
+			process_resources(resource_handler, shard_resources, 'all', args.bulk_import, args.incremental,
+				state_index, checkpoint, args.snapshot_compression, args.resource_schemas)
+	logging.info(f'{resource_type}: exported {len(shards)} shards by {resource_handler.shard_attribute} '
+		f'to {os.path.join(args.shards_dir, resource_type)}')
+
+def process_resources(resource_handler, resources, num_resources, bulk_import=False, incremental=False,
+		state_index=None, checkpoint=None, snapshot_compression='none', resource_schemas=None):
+	"""
+	Render, snapshot and import the resources of one handler. `resources` can be any
+	iterable, configuration and snapshot are written while it is being consumed. In
+	incremental mode only resources that changed since the previous snapshot are
+	rendered and imported. Resources found in state_index, or imported according to
+	the checkpoint, are not imported again. With resource_schemas the configuration is
+	validated first, raising ConfigValidationError instead of importing anything.
+	"""
+	if num_resources != 'all':
+		resources = itertools.islice(resources, num_resources)
+	if resource_handler.field_set == SUMMARY_FIELDS:
+		plan_imports(resource_handler, resources, state_index)
 		return
 
-	resource_class = resource_classes[resource_type]
-	resource_handler = resource_class(resource_type, account_id, api_key)
+	resources_to_import = render_resources(resource_handler, resources, incremental, snapshot_compression)
+	if resource_schemas is not None:
+		validate_config([resource_handler], resource_schemas)
+	import_resources(resource_handler, resources_to_import, bulk_import, state_index, checkpoint)
+
+def render_resources(resource_handler, resources, incremental=False, snapshot_compression='none'):
+	"""
+	Write the configuration and snapshot of the resources of one handler.
+	Returns the resources to import: all of them, or in incremental mode the ones
+	that changed since the previous snapshot.
+	"""
+	resource_type = resource_handler.resource_type
+	snapshot_base = resource_type + "before_change"
+	snapshot = SnapshotWriter(snapshot_base, snapshot_compression)
+	try:
+		diff = None
+		if incremental:
+			resources_to_process = list(resources)
+			diff = incremental_update(resource_handler, resources_to_process, snapshot_base)
+			if diff is None:
+				logging.info(f'No previous snapshot {snapshot_base}, running a full import.')
+				resource_handler.create_terraform_config(resources_to_process)
+			for resource in resources_to_process:
+				snapshot.write(resource)
+		else:
+			resources_to_process = []
+			def collect(entities):
+				for entity in entities:
+					resources_to_process.append(entity)
+					snapshot.write(entity)
+					yield entity
+
+			resource_handler.create_terraform_config(collect(resources))
+	except BaseException:
+		snapshot.abort()
+		raise
+	snapshot.commit()
 
-	resources = resource_handler.fetch_resources()
+	resources_to_import = resources_to_process if diff is None else diff.added + diff.changed
+	if not resources_to_import:
+		if diff is not None:
+			logging.info(f'No new or changed resources of type {resource_type}.')
+		else:
+			logging.info(f'No resources found for type {resource_type}.')
+	return resources_to_import
 
-	if num_resources == 'all':
-		resources_to_process = resources
+def import_resources(resource_handler, resources_to_import, bulk_import=False, state_index=None, checkpoint=None,
+		target=False):
+	"""
+	Import the resources that are neither in state_index nor imported according to the checkpoint.
+	"""
+	if not resources_to_import:
+		return
+	resource_type = resource_handler.resource_type
+	resources_to_import, skipped = resource_handler.filter_unmanaged(resources_to_import, state_index)
+	on_imported = None
+	if checkpoint is not None:
+		resources_to_import, resumed = checkpoint.filter_imported(resource_handler, resources_to_import)
+		skipped += resumed
+		on_imported = lambda resource: checkpoint.mark_imported(resource_handler, resource)
+	logging.info(f'Importing {len(resources_to_import)} resources of type {resource_type}.')
+	if not resources_to_import:
+		failures = {}
+	elif bulk_import:
+		failures = resource_handler.bulk_import_to_terraform(resources_to_import, on_imported, target)
 	else:
-		try:
-			num_resources = int(num_resources)
-			resources_to_process = resources[:num_resources]
-		except ValueError:
-			logging.error("Invalid number of resources specified. Please provide an integer or 'all'.")
-			return
+		failures = resource_handler.import_to_terraform(resources_to_import, on_imported)
+	logging.info(f'{resource_type}: {len(resources_to_import) - len(failures)} imported, '
+		f'{skipped} skipped as already in state or imported before, {len(failures)} failed.')
 
-	filename = resource_type + "before_change.json"
+def plan_imports(resource_handler, resources, state_index=None):
+	"""
+	Write the address and import ID of every resource that is not in the terraform state
+	yet to <resource_type>_import_plan.json, without rendering or importing anything.
+	"""
+	resource_type = resource_handler.resource_type
+	resources_to_import, skipped = resource_handler.filter_unmanaged(resources, state_index)
+	filename = resource_type + '_import_plan.json'
 	with open(filename, 'w') as f:
-		json.dump(resources_to_process, f, indent=4)
+		json.dump([{'address': resource_handler.get_resource_address(resource), 'id': resource_handler.get_import_id(resource)}
+			for resource in resources_to_import], f, indent=4)
+	logging.info(f'{resource_type}: {len(resources_to_import)} to import, {skipped} already in state, '
+		f'plan written to {filename}')
 
-	if resources_to_process:
-		logging.info(f'Importing {len(resouces_to_process)} resources of type {resource_type}.')
-		resource_handler.create_terraform_config(resources_to_process)
-		resource_handler.import_to_terraform(resources_to_process)
-	else:
-		logging.info(f'No resources found for type {resource_type}.')
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='Import existing New Relic resources into Terraform.')
+	parser.add_argument('resource_type', nargs='?', help='Terraform resource type to import, e.g. newrelic_nrql_alert_condition')
+	parser.add_argument('num_resources', nargs='?', default='all', help="Number of resources to import, or 'all'")
+	parser.add_argument('--bulk-import', action='store_true',
+		help='Import with generated import blocks and a single terraform plan/apply (terraform >= 1.5)')
+	parser.add_argument('--nerdgraph-url', default=os.getenv('NERDGRAPH_URL', NERDGRAPH_URL),
+		help='NerdGraph endpoint, e.g. a local mock server (default: $NERDGRAPH_URL or the US endpoint)')
+	parser.add_argument('--connect-timeout', type=float, default=5, help='NerdGraph connect timeout in seconds')
+	parser.add_argument('--read-timeout', type=float, default=60, help='NerdGraph read timeout in seconds')
+	parser.add_argument('--max-retries', type=int, default=5, help='Retries per NerdGraph page on 429/5xx/timeouts')
+	parser.add_argument('--prefetch-pages', type=int, default=4,
+		help='Pages to download ahead of the renderer')
+	parser.add_argument('--types',
+		help="Comma separated resource types, or 'all', fetched concurrently in one run")
+	parser.add_argument('--max-in-flight', type=int, default=8,
+		help='Maximum concurrent NerdGraph requests of a run, shared by all resource types and accounts and by '
+			'both the async and the sync client. Starting at 4, the limit is raised while requests go well and '
+			'lowered on 429s, errors and growing latency. terraform processes are limited by --import-workers')
+	parser.add_argument('--min-in-flight', type=int, default=1,
+		help='Concurrent NerdGraph requests the adaptive limit never goes below')
+	parser.add_argument('--import-workers', type=int, default=1,
+		help='Maximum concurrent terraform import processes. Starting at 1, the limit is raised while imports '
+			'go well and lowered when they fail or slow down waiting for the state lock')
+	parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default=HCL_FORMAT,
+		help='Write the configuration as HCL (<resource_type>.tf) or as JSON (<resource_type>.tf.json), '
+			'encoded with orjson when installed')
+	parser.add_argument('--shard-layout', choices=('files', 'directories'),
+		help='Split NRQL conditions by policy and channels by destination, into one <resource_type>.<shard>.tf '
+			'file per shard, or into one directory with its own terraform state per shard')
+	parser.add_argument('--shards-dir', default='shards',
+		help='Directory holding the shard directories with --shard-layout directories')
+	parser.add_argument('--render-workers', type=int, default=0,
+		help='Render the terraform configuration in this many worker processes, for very large exports')
+	parser.add_argument('--max-parallel-stages', type=int, default=2,
+		help='Resource types imported at the same time when using --types, once the types they reference are imported')
+	parser.add_argument('--cache-dir',
+		help=f'Cache NerdGraph responses in this directory and reuse them on later runs (e.g. {DEFAULT_CACHE_DIR})')
+	parser.add_argument('--cache-ttl', type=int, default=24 * 60 * 60, help='Seconds before a cached response expires')
+	parser.add_argument('--cache-max-mb', type=int, default=1024, help='Size the response cache is evicted down to')
+	parser.add_argument('--offline', action='store_true',
+		help='Replay a previous run from the response cache only, no API key needed')
+	parser.add_argument('--account-ids',
+		help='Comma separated account IDs to export in one run, overrides ACCOUNT_ID')
+	parser.add_argument('--account-batch-size', type=int, default=10,
+		help='Accounts fetched per NerdGraph request when exporting several accounts')
+	parser.add_argument('--accounts-dir', default='.',
+		help='Directory holding one working directory per account when exporting several accounts')
+	parser.add_argument('--incremental', action='store_true',
+		help='Only re-render and import resources that changed since the previous snapshot')
+	parser.add_argument('--ids-only', action='store_true',
+		help='Only fetch IDs and names and write the imports still missing from the terraform state to '
+			'<resource_type>_import_plan.json, without rendering or importing anything')
+	parser.add_argument('--filter-config',
+		help='JSON file with NRQL condition filters: policy_ids, include_names, exclude_names and enabled_only')
+	parser.add_argument('--policy-ids', type=lambda value: value.split(','),
+		help='Only import NRQL conditions of these comma separated policy IDs')
+	parser.add_argument('--include-name', action='append',
+		help='Only import NRQL conditions whose name matches this regular expression, can be repeated')
+	parser.add_argument('--exclude-name', action='append',
+		help="Leave out NRQL conditions whose name matches this regular expression, can be repeated "
+			"(default: 'Web Ping Health Check' and 'Services down for' unless any name filter is set)")
+	parser.add_argument('--enabled-only', action='store_true', help='Only import enabled NRQL conditions')
+	parser.add_argument('--snapshot-compression', choices=COMPRESSIONS, default='none',
+		help='Compress the <resource_type>before_change.ndjson snapshot, zstd needs the zstandard package')
+	parser.add_argument('--state-file', help='Read managed resources from this state file instead of terraform show -json')
+	parser.add_argument('--resume', action='store_true',
+		help='Continue an interrupted run from its checkpoint instead of fetching and importing everything again')
+	parser.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR,
+		help='Where the progress of a run is recorded, removed once a run completes')
+	parser.add_argument('--report', help='Write timings and counters of the run to this JSON file')
+	parser.add_argument('--prometheus-textfile',
+		help='Write timings and counters in the Prometheus text format, e.g. for the node_exporter textfile collector')
+	parser.add_argument('--fleet',
+		help='JSON manifest of accounts and their API keys, each run in its own process and directory under --fleet-dir')
+	parser.add_argument('--fleet-workers', type=int, default=4, help='Accounts of a --fleet run exported at the same time')
+	parser.add_argument('--fleet-dir', default='fleet',
+		help='Directory holding one working directory (and terraform state) per account of a --fleet run')
+	parser.add_argument('--watch', action='store_true',
+		help='Keep running and poll New Relic for drift from the exported configuration, reported as events '
+			'in --drift-events with a patch for the configuration in --drift-patch-dir')
+	parser.add_argument('--watch-interval', type=float, default=DEFAULT_WATCH_INTERVAL, help='Seconds between --watch polls')
+	parser.add_argument('--watch-count', type=int, default=0, help='Stop --watch after this many polls, 0 runs until stopped')
+	parser.add_argument('--drift-events', default=DEFAULT_EVENTS_FILE,
+		help='File the drift events of --watch are appended to, one JSON object per line')
+	parser.add_argument('--drift-patch-dir', default=DEFAULT_PATCH_DIR,
+		help='Directory the configuration patches of --watch are written to')
+	parser.add_argument('--skip-state-check', action='store_true',
+		help='Import every resource even if it is already in the terraform state')
+	parser.add_argument('--names-file', default=DEFAULT_NAMES_FILE,
+		help='Resource names allocated in earlier runs, kept so addresses stay stable when resources are renamed')
+	parser.add_argument('--skip-validation', action='store_true',
+		help='Do not check the generated configuration against the provider schema before importing')
+	parser.add_argument('--provider-schema',
+		help='Output of `terraform providers schema -json` to validate against, instead of the bundled snapshot')
+	return parser.parse_args(argv)
 
 if __name__ == "__main__":
-	if len(sys.argv) < 2:
-		logging.error("Usage: python import_resources.py [resource_type] [num_of_resources]")
-		sys.exit(1)
+	args = parse_args(sys.argv[1:])
 
-	resource_type = sys.argv[1]
-	num_resources = sys.argv[2] if len(sys.argv) > 2 else 'all'
+	if args.fleet:
+		try:
+			fleet_metrics, results = run_fleet(args.fleet, sys.argv[1:], args)
+		except (OSError, ValueError) as e:
+			logging.error(f'Invalid fleet manifest: {e}')
+			sys.exit(2)
+		for result in results:
+			logging.info(f"{result['account_id']}: {result['status']}" + (f", {result['error']}" if result.get('error') else ''))
+		for line in fleet_metrics.summary():
+			logging.info(line)
+		report_file = args.report or os.path.join(args.fleet_dir, 'fleet_report.json')
+		fleet_metrics.write_report(report_file, accounts=summarize(results))
+		logging.info(f'Fleet report written to {report_file}')
+		if args.prometheus_textfile:
+			fleet_metrics.write_prometheus(args.prometheus_textfile)
+		sys.exit(0 if all(result['status'] == 'succeeded' for result in results) else 1)
 
 	# Get the environment variables
-	account_id = os.getenv('ACCOUNT_ID')
+	account_id = args.account_ids or os.getenv('ACCOUNT_ID')
 	api_key = os.getenv('API_KEY')
 
-	if not account_id or not api_key:
+	if not account_id or not (api_key or args.offline):
 		raise ValueError("ACCOUNT_ID and API_KEY must be set in environment variables")
 
 	start_time = time.time()
-	main(resource_type, num_resources, account_id, api_key)
+	succeeded = False
+	try:
+		with metrics.span('run'):
+			succeeded = main(args, account_id, api_key or '')
+	finally:
+		for line in metrics.summary():
+			logging.info(line)
+		if args.report:
+			metrics.write_report(args.report)
+		if args.prometheus_textfile:
+			metrics.write_prometheus(args.prometheus_textfile)
 	end_time = time.time()
 	duration = end_time - start_time
-	print(f"Duration: {duration: .4f} seconds")
\ No newline at end of file
+	print(f"Duration: {duration: .4f} seconds")
+	# A fleet reports an account as failed by its exit status
+	if not succeeded:
+		sys.exit(1)
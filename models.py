@@ -0,0 +1,296 @@
+import sys
+from dataclasses import dataclass
+
+
+class ModelError(ValueError):
+	"""
+	Raised when a NerdGraph entity does not have the shape the models expect.
+	"""
+
+
+def parse_entity(model, data):
+	"""
+	Build `model` from a NerdGraph entity, turning a missing field into a ModelError
+	that names the entity instead of a KeyError at render time.
+	"""
+	try:
+		return model.from_dict(data)
+	except KeyError as e:
+		raise ModelError(f"{model.__name__} with ID {data.get('id')} is missing field {e}") from None
+	except (TypeError, AttributeError) as e:
+		raise ModelError(f"{model.__name__} with ID {data.get('id')} is malformed: {e}") from None
+
+
+def _intern(value):
+	# Enum-like strings repeat across every entity, share one copy of each
+	return sys.intern(value) if isinstance(value, str) else value
+
+
+@dataclass(slots=True, frozen=True)
+class Term:
+	operator: str
+	priority: str
+	threshold: float
+	threshold_duration: int
+	threshold_occurrences: str
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(
+			_intern(data['operator']),
+			_intern(data['priority']),
+			data['threshold'],
+			data['thresholdDuration'],
+			_intern(data['thresholdOccurrences'])
+		)
+
+	def to_dict(self):
+		return {
+			'operator': self.operator,
+			'priority': self.priority,
+			'threshold': self.threshold,
+			'thresholdDuration': self.threshold_duration,
+			'thresholdOccurrences': self.threshold_occurrences
+		}
+
+
+@dataclass(slots=True, frozen=True)
+class Signal:
+	slide_by: int
+	fill_option: str
+	aggregation_method: str
+	aggregation_delay: int
+	aggregation_window: int
+	aggregation_timer: int
+	evaluation_delay: int
+	fill_value: float
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(
+			data['slideBy'],
+			_intern(data['fillOption']),
+			_intern(data['aggregationMethod']),
+			data['aggregationDelay'],
+			data['aggregationWindow'],
+			data['aggregationTimer'],
+			data['evaluationDelay'],
+			data['fillValue']
+		)
+
+	def to_dict(self):
+		return {
+			'slideBy': self.slide_by,
+			'fillOption': self.fill_option,
+			'aggregationMethod': self.aggregation_method,
+			'aggregationDelay': self.aggregation_delay,
+			'aggregationWindow': self.aggregation_window,
+			'aggregationTimer': self.aggregation_timer,
+			'evaluationDelay': self.evaluation_delay,
+			'fillValue': self.fill_value
+		}
+
+
+@dataclass(slots=True, frozen=True)
+class Expiration:
+	close_violations_on_expiration: bool
+	expiration_duration: int
+	ignore_on_expected_termination: bool
+	open_violation_on_expiration: bool
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(
+			data['closeViolationsOnExpiration'],
+			data['expirationDuration'],
+			data['ignoreOnExpectedTermination'],
+			data['openViolationOnExpiration']
+		)
+
+	def to_dict(self):
+		return {
+			'closeViolationsOnExpiration': self.close_violations_on_expiration,
+			'expirationDuration': self.expiration_duration,
+			'ignoreOnExpectedTermination': self.ignore_on_expected_termination,
+			'openViolationOnExpiration': self.open_violation_on_expiration
+		}
+
+
+@dataclass(slots=True)
+class Condition:
+	id: str
+	name: str
+	policy_id: str
+	query: str
+	terms: list
+	signal: Signal
+	expiration: Expiration
+	enabled: bool
+	runbook_url: str
+	type: str
+	violation_time_limit_seconds: int
+	description: str
+	title_template: str
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(
+			data['id'],
+			data['name'],
+			data['policyId'],
+			data['nrql']['query'],
+			[Term.from_dict(term) for term in data['terms']],
+			Signal.from_dict(data['signal']) if data['signal'] is not None else None,
+			Expiration.from_dict(data['expiration']) if data['expiration'] is not None else None,
+			data['enabled'],
+			data['runbookUrl'],
+			_intern(data['type']),
+			data['violationTimeLimitSeconds'],
+			data['description'],
+			data['titleTemplate']
+		)
+
+	def to_dict(self):
+		return {
+			'id': self.id,
+			'name': self.name,
+			'policyId': self.policy_id,
+			'nrql': {'query': self.query},
+			'terms': [term.to_dict() for term in self.terms],
+			'signal': self.signal.to_dict() if self.signal is not None else None,
+			'expiration': self.expiration.to_dict() if self.expiration is not None else None,
+			'enabled': self.enabled,
+			'runbookUrl': self.runbook_url,
+			'type': self.type,
+			'violationTimeLimitSeconds': self.violation_time_limit_seconds,
+			'description': self.description,
+			'titleTemplate': self.title_template
+		}
+
+
+@dataclass(slots=True)
+class Property:
+	key: str
+	value: str
+	display_value: str
+	label: str = None
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(_intern(data['key']), data['value'], data['displayValue'], data.get('label'))
+
+	def to_dict(self):
+		data = {'key': self.key, 'value': self.value, 'displayValue': self.display_value}
+		if self.label is not None:
+			data['label'] = self.label
+		return data
+
+
+@dataclass(slots=True)
+class Channel:
+	id: str
+	name: str
+	type: str
+	destination_id: str
+	product: str
+	properties: list
+	status: str
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(
+			data['id'],
+			data['name'],
+			_intern(data['type']),
+			data['destinationId'],
+			_intern(data['product']),
+			[Property.from_dict(prop) for prop in data['properties']],
+			_intern(data['status'])
+		)
+
+	def to_dict(self):
+		return {
+			'id': self.id,
+			'name': self.name,
+			'type': self.type,
+			'destinationId': self.destination_id,
+			'product': self.product,
+			'properties': [prop.to_dict() for prop in self.properties],
+			'status': self.status
+		}
+
+
+@dataclass(slots=True)
+class Auth:
+	auth_type: str
+	prefix: str
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(_intern(data.get('authType')), data.get('prefix'))
+
+	def to_dict(self):
+		return {'authType': self.auth_type, 'prefix': self.prefix}
+
+
+@dataclass(slots=True)
+class Destination:
+	id: str
+	name: str
+	type: str
+	properties: list
+	auth: Auth
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(
+			data['id'],
+			data['name'],
+			_intern(data['type']),
+			[Property.from_dict(prop) for prop in data['properties'] or []],
+			Auth.from_dict(data['auth']) if data['auth'] else None
+		)
+
+	def to_dict(self):
+		return {
+			'id': self.id,
+			'name': self.name,
+			'type': self.type,
+			'properties': [prop.to_dict() for prop in self.properties],
+			'auth': self.auth.to_dict() if self.auth is not None else None
+		}
+
+
+@dataclass(slots=True)
+class Policy:
+	id: str
+	name: str
+	incident_preference: str
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(data['id'], data['name'], _intern(data['incidentPreference']))
+
+	def to_dict(self):
+		return {'id': self.id, 'name': self.name, 'incidentPreference': self.incident_preference}
+
+
+@dataclass(slots=True)
+class EntitySummary:
+	"""
+	The fields of any entity needed to find it in the terraform state and import it,
+	fetched instead of the full model when only planning imports.
+	"""
+	id: str
+	name: str
+	policy_id: str = None
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(data['id'], data['name'], data.get('policyId'))
+
+	def to_dict(self):
+		data = {'id': self.id, 'name': self.name}
+		if self.policy_id is not None:
+			data['policyId'] = self.policy_id
+		return data
@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from instrumentation import increment
+from utils import modify_name
+
+
+DEFAULT_NAMES_FILE = 'resource_names.json'
+
+
+class NameAllocator:
+	"""
+	Terraform resource name of every entity by resource type and ID, computed once per
+	run and shared by rendering, references, imports and the state check, so they all
+	agree on the address of a resource.
+
+	Two entities whose names sanitize to the same string would declare the same resource
+	twice. The first one allocated keeps the name and the others get _2, _3, ... in the
+	order they are allocated. Names loaded from `filename` are kept, so a resource keeps
+	its address across runs even when it is renamed in New Relic or another entity
+	comes to sanitize to its name. Delete the file to derive all names afresh.
+	"""
+	def __init__(self, filename=None):
+		self.filename = filename
+		# resource_type -> {id: name}
+		self.names = {}
+		# resource_type -> {name: id}
+		self.owners = {}
+		self.changed = False
+		self.lock = threading.Lock()
+		if filename is not None:
+			self.load()
+
+	def load(self):
+		try:
+			with open(self.filename) as f:
+				names = json.load(f)
+		except FileNotFoundError:
+			return
+		except ValueError as e:
+			logging.warning(f'Ignoring unreadable {self.filename}, names are derived afresh: {e}')
+			return
+		for resource_type, type_names in names.items():
+			self.assign(resource_type, type_names)
+		self.changed = False
+		logging.info(f'Loaded {sum(map(len, self.names.values()))} resource names from {self.filename}')
+
+	def assign(self, resource_type, names):
+		"""
+		Record names allocated elsewhere, {id: name}, e.g. in the process rendering the entities.
+		"""
+		with self.lock:
+			type_names = self.names.setdefault(resource_type, {})
+			owners = self.owners.setdefault(resource_type, {})
+			for entity_id, name in names.items():
+				type_names[entity_id] = name
+				owners[name] = entity_id
+			self.changed = True
+
+	def allocate(self, resource_type, entity_id, name):
+		"""
+		Returns the resource name of the entity, allocating a unique one on first use.
+		"""
+		entity_id = str(entity_id)
+		allocated = self.names.get(resource_type, {}).get(entity_id)
+		if allocated is not None:
+			return allocated
+		with self.lock:
+			type_names = self.names.setdefault(resource_type, {})
+			owners = self.owners.setdefault(resource_type, {})
+			if entity_id in type_names:
+				return type_names[entity_id]
+			candidate = modify_name(name, entity_id)
+			allocated = candidate
+			suffix = 1
+			while allocated in owners:
+				suffix += 1
+				allocated = f'{candidate}_{suffix}'
+			if allocated != candidate:
+				increment('resource_name_collisions', resource_type=resource_type)
+				logging.warning(f'{resource_type} {entity_id} would be named {candidate} like {owners[candidate]}, '
+					f'named {allocated} instead')
+			type_names[entity_id] = allocated
+			owners[allocated] = entity_id
+			self.changed = True
+			return allocated
+
+	def save(self):
+		"""
+		Write the names to `filename` when any were allocated since it was loaded.
+		"""
+		if self.filename is None or not self.changed:
+			return
+		with self.lock:
+			fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filename)), suffix='.tmp')
+			with os.fdopen(fd, 'w') as f:
+				json.dump(self.names, f, indent=1, sort_keys=True)
+			os.replace(tmp_path, self.filename)
+			self.changed = False
+		logging.info(f'Saved {sum(map(len, self.names.values()))} resource names to {self.filename}')
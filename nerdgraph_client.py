@@ -0,0 +1,186 @@
+import email.utils
+import logging
+import random
+import time
+from contextlib import nullcontext
+import requests
+from requests.adapters import HTTPAdapter
+from concurrency import FAILED, SUCCESS, THROTTLED, Slot
+from instrumentation import increment, span
+
+
+NERDGRAPH_URL = 'https://api.newrelic.com/graphql'
+
+# HTTP statuses and NerdGraph error classes worth retrying, everything else fails fast
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_ERROR_CLASSES = {'TIMEOUT', 'SERVER_ERROR', 'TOO_MANY_REQUESTS'}
+# Start of the error check_response reports for TOO_MANY_REQUESTS errors
+RATE_LIMITED = 'NerdGraph rate limit'
+
+
+class NerdGraphError(Exception):
+	"""
+	Raised when NerdGraph answers with GraphQL errors, or keeps failing after all retries.
+	"""
+	def __init__(self, message, errors=None):
+		super().__init__(message)
+		self.errors = errors or []
+
+
+class BaseNerdGraphClient:
+	"""
+	Retry policy and response handling shared by the sync and async NerdGraph clients.
+	"""
+	def __init__(self, api_key, base_url=NERDGRAPH_URL, connect_timeout=5, read_timeout=60,
+			max_retries=5, backoff_factor=1.0, max_backoff=60, cache=None, concurrency=None):
+		self.base_url = base_url
+		self.cache = cache
+		# AIMDController limiting the requests in flight, shared by every client of a run
+		self.concurrency = concurrency
+		self.headers = {
+			'Content-Type': 'application/json',
+			'Accept-Encoding': 'gzip, deflate',
+			'API-Key': api_key
+		}
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.max_retries = max_retries
+		self.backoff_factor = backoff_factor
+		self.max_backoff = max_backoff
+
+	def cache_lookup(self, query, account_id, cursor):
+		"""
+		Returns (key, data) for the response cache, data is None on a miss or without a cache.
+		"""
+		if self.cache is None:
+			return None, None
+		key = self.cache.key(account_id, query, cursor)
+		data = self.cache.get(key)
+		increment('nerdgraph_cache_hits' if data is not None else 'nerdgraph_cache_misses')
+		return key, data
+
+	def cache_store(self, key, data):
+		if key is not None:
+			self.cache.put(key, data)
+
+	def check_response(self, status_code, headers, decode, partial=False):
+		"""
+		Returns (data, error, retry_after). data is set when the response is usable,
+		otherwise error describes a retryable failure. Raises NerdGraphError when
+		retrying can not help. With partial, a response that carries data next to
+		non-retryable errors is usable, the caller attributes the errors by their path.
+		"""
+		if status_code in RETRY_STATUS_CODES:
+			increment('nerdgraph_http_errors', status=status_code)
+			return None, f'HTTP {status_code}', parse_retry_after(headers.get('Retry-After'))
+		if status_code >= 400:
+			raise NerdGraphError(f'HTTP {status_code} from {self.base_url}')
+		data = decode()
+		errors = data.get('errors')
+		if not errors:
+			return data, None, None
+		if not any(_error_class(e) in RETRY_ERROR_CLASSES for e in errors):
+			if partial and data.get('data'):
+				return data, None, None
+			raise NerdGraphError(f"NerdGraph returned errors: {errors}", errors)
+		if any(_error_class(e) == 'TOO_MANY_REQUESTS' for e in errors):
+			return None, f"{RATE_LIMITED}: {errors}", None
+		return None, f"NerdGraph errors: {errors}", None
+
+	def request_outcome(self, status_code, error):
+		"""
+		Returns how a request went according to check_response, for the concurrency controller.
+		"""
+		if error is None:
+			return SUCCESS
+		if status_code == 429 or error.startswith(RATE_LIMITED):
+			return THROTTLED
+		return FAILED
+
+	def next_retry(self, attempt, error, retry_after=None):
+		"""
+		Returns how long to sleep before the next attempt, or raises once retries are exhausted.
+		"""
+		if attempt >= self.max_retries:
+			increment('nerdgraph_failures')
+			raise NerdGraphError(f'Giving up after {attempt + 1} attempts: {error}')
+		delay = self.backoff(attempt, retry_after)
+		increment('nerdgraph_retries')
+		logging.warning(f'NerdGraph request failed ({error}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s')
+		return delay
+
+	def backoff(self, attempt, retry_after=None):
+		# Full jitter exponential backoff, never sooner than the server asked for
+		delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+		if retry_after is not None:
+			delay = max(delay, min(retry_after, self.max_backoff))
+		return delay
+
+
+class NerdGraphClient(BaseNerdGraphClient):
+	"""
+	Keep-alive, retrying transport for NerdGraph queries.
+	One client (and its connection pool) is meant to be shared by every resource handler.
+	"""
+	def __init__(self, api_key, pool_size=10, **kwargs):
+		super().__init__(api_key, **kwargs)
+		self.timeout = (self.connect_timeout, self.read_timeout)
+		self.session = requests.Session()
+		self.session.headers.update(self.headers)
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+		self.session.mount('https://', adapter)
+		self.session.mount('http://', adapter)
+
+	def execute(self, query, account_id=None, cursor=None, partial=False):
+		"""
+		Post a GraphQL query and return the decoded response body.
+		Connection errors, timeouts, 429/5xx responses and transient NerdGraph errors are
+		retried with exponential backoff and jitter, honouring Retry-After when it is sent.
+		With a concurrency controller the request waits for a slot, not the backoff.
+		account_id and cursor complete the response cache key when a cache is configured.
+		See check_response for partial.
+		"""
+		key, data = self.cache_lookup(query, account_id, cursor)
+		if data is not None:
+			return data
+		attempt = 0
+		while True:
+			retry_after = None
+			try:
+				increment('nerdgraph_requests')
+				with self.concurrency.slot() if self.concurrency is not None else nullcontext(Slot()) as slot:
+					with span('nerdgraph_request'):
+						response = self.session.post(self.base_url, json={'query': query}, timeout=self.timeout)
+					increment('nerdgraph_bytes_received', len(response.content))
+					data, error, retry_after = self.check_response(response.status_code, response.headers, response.json, partial)
+					slot.outcome = self.request_outcome(response.status_code, error)
+				if data is not None:
+					self.cache_store(key, data)
+					return data
+			except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+				error = str(e)
+			time.sleep(self.next_retry(attempt, error, retry_after))
+			attempt += 1
+
+	def close(self):
+		self.session.close()
+
+
+def parse_retry_after(value):
+	"""
+	Returns the Retry-After header value in seconds, it can be sent as seconds or an HTTP date.
+	"""
+	if not value:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	try:
+		return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
+
+
+def _error_class(error):
+	return (error.get('extensions') or {}).get('errorClass')
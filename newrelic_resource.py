@@ -1,69 +1,531 @@
+import glob
+import json
 import logging
+import os
+import re
 import subprocess
-from utils import modify_name
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import requests
+from hcl_renderer import WRITE_CHUNK_SIZE, write_blocks
+from instrumentation import increment, metrics, span
+from json_renderer import JSON_FOOTER, MEMBER_SEPARATOR, json_header, render_member
+from models import EntitySummary, ModelError, parse_entity
+from name_allocator import NameAllocator
+from nerdgraph_client import NerdGraphClient, NerdGraphError
+from parallel_render import RenderPool, fork_available
+from query_builder import FULL_FIELDS, SUMMARY_FIELDS, build_search_query
+
+
+# Configuration formats create_terraform_config can write
+HCL_FORMAT = 'hcl'
+JSON_FORMAT = 'json'
+OUTPUT_FORMATS = (HCL_FORMAT, JSON_FORMAT)
+# Concurrent terraform runs in one working directory wait this long for the state lock
+LOCK_TIMEOUT = '-lock-timeout=5m'
+# A saved plan goes stale when another import changes the state before it is applied,
+# so plan and apply of bulk imports running in parallel stages take turns
+BULK_IMPORT_LOCK = threading.Lock()
+# Characters kept when a shard key is used in a file or directory name
+_UNSAFE_SHARD_CHARACTERS = re.compile(r'[^\w.-]')
 
 
 class NewRelicResource:
-	def __init__(self, resource_type, account_id, api_key):
+	# Typed model the NerdGraph entities are parsed into, set by child classes
+	model = None
+	# Query descriptor, set by child classes: the path from the account to the paginated
+	# search field, the field listing its entities, the full field schema and the
+	# schema of the summary field set (IDs and whatever import addresses are built from)
+	search_path = ()
+	entities_field = 'entities'
+	fields = []
+	summary_fields = ['id', 'name']
+	# Resource types this one references, mapped to the model attribute holding the referenced ID
+	depends_on = {}
+	# Model attribute the configuration can be sharded by, e.g. the policy of a condition
+	shard_attribute = None
+	# NerdGraph field changing with every edit of an entity, lets drift_watch.py skip
+	# fetching the full entities while none changed. None when the type has no such field
+	version_field = None
+
+	def __init__(self, resource_type, account_id, api_key, client=None, field_set=FULL_FIELDS, render_workers=0,
+			shard_files=False, output_format=HCL_FORMAT, import_concurrency=None, name_allocator=None):
 		self.resource_type = resource_type
 		self.account_id = account_id
-		self.base_url = 'https://api.newrelic.com/graphql'
-		self.headers = {
-			'Contents-Type': 'application/json',
-			'API-Key': api_key
-		}
-		self.query = self.get_graphql_first_query()
+		# Share one client between handlers to reuse its connection pool
+		self.client = client or NerdGraphClient(api_key)
+		self.field_set = field_set
+		# AddressIndex of the resources rendered in the same run, see import_graph.py
+		self.address_index = None
+		# Worker processes rendering the configuration, 0 or 1 renders in this process
+		self.render_workers = render_workers
+		# Write one <resource_type>.<shard>.tf file per shard instead of a single file
+		self.shard_files = shard_files
+		# HCL for people to read, or .tf.json generated straight from the entity data
+		self.output_format = output_format
+		self.block_separator = MEMBER_SEPARATOR if output_format == JSON_FORMAT else ''
+		# AIMDController for concurrent `terraform import` processes, shared by the handlers
+		# of a run since they all lock the same state. None imports one resource at a time
+		self.import_concurrency = import_concurrency
+		# Resource names of the run, shared by the handlers of a run and persisted between runs
+		self.name_allocator = name_allocator or NameAllocator()
 
-	def get_graphql_first_query(self):
+	def get_fields(self):
 		"""
-		Returns the GraphQL query string based on the resource type.
-		First query to fetch the next request's cursor value.
-		Override this method in child classes to provide the query for specific resource type.
+		Returns the field schema requested for the handler's field set.
 		"""
-		raise NotImplementedError
+		return self.summary_fields if self.field_set == SUMMARY_FIELDS else self.fields
 
-	def get_graphql_subsequent_query(self):
+	def build_query(self, cursor=None):
 		"""
-		Returns the GraphQL query string based on the resource type.
-		Subsequent requests to make as long as we get back a nextCursor value.
-		Override this method in child classes to provide the query for specific resource type.
+		Returns the query for the first page, or for the page at the given cursor.
 		"""
-		raise NotImplementedError
+		return build_search_query(self.account_id, self.search_path, self.entities_field, self.get_fields(), cursor,
+			self.get_search_arguments())
+
+	def get_search_arguments(self):
+		"""
+		Returns the arguments passed to the search field besides the cursor.
+		Override this method in child classes to filter on the server.
+		"""
+		return {}
+
+	def get_search_result(self, json_data):
+		"""
+		Returns the search field of the graphQL response, holding the entities and nextCursor.
+		"""
+		result = json_data['data']['actor']['account']
+		for field in self.search_path:
+			result = result[field]
+		return result
+
+	def get_next_cursor(self, json_data):
+		"""
+		Returns the nextCursor value of the graphQL response.
+		"""
+		return self.get_search_result(json_data)['nextCursor']
+
+	def iter_pages(self, cursor=None):
+		"""
+		Generator form of fetch_resources, yielding (entities, next_cursor) for every page
+		as soon as it is downloaded. Pass a cursor to start from a later page.
+		"""
+		while True:
+			with span('page_fetch', resource_type=self.resource_type):
+				data = self.client.execute(self.build_query(cursor), self.account_id, cursor)
+				cursor = self.get_next_cursor(data)
+				entities = self.extract_entities(data)
+			increment('pages_fetched', resource_type=self.resource_type)
+			increment('entities_fetched', len(entities), resource_type=self.resource_type)
+			yield entities, cursor
+			if not cursor:
+				return
+
+	def iter_resources(self):
+		"""
+		Yields the fetched entities one by one, page by page.
+		"""
+		for entities, _ in self.iter_pages():
+			yield from entities
 
 	def fetch_resources(self):
 		"""
 		Fetch resources from NewRelic using the appropriate GraphQL query.
-		Override this method in child classes to provide the query for specific resource type.
+		Every page goes through the shared client, so a failing page is retried on its own cursor.
 		"""
-		raise NotImplementedError
+		try:
+			return list(self.iter_resources())
+		except (requests.exceptions.RequestException, NerdGraphError) as e:
+			logging.error(f'Error fetching resources: {e}')
+			return []
+		except KeyError as e:
+			logging.error(f'KeyError: {e} in NerdGraph response')
+			return []
+		except ModelError as e:
+			logging.error(f'Unexpected NerdGraph response: {e}')
+			return []
 
-	def extract_entities(self):
+	def include_entity(self, entity):
+		"""
+		Returns whether an entity of the graphQL response, as the raw dict, is imported.
+		Override this method in child classes to filter out entities that should not be imported.
+		"""
+		return True
+
+	def extract_entities(self, json_data):
 		"""
 		Extract resource entities from the graphQL response.
+		"""
+		entities = self.get_search_result(json_data)[self.entities_field]
+		filtered_entities = [self.parse_entity(entity) for entity in entities if self.include_entity(entity)]
+		if len(filtered_entities) != len(entities):
+			increment('entities_filtered', len(entities) - len(filtered_entities), resource_type=self.resource_type)
+		return filtered_entities
+
+	def get_shard(self, entity):
+		"""
+		Returns the name of the shard the entity belongs to, None when the resource type
+		is not sharded or the entity lacks the shard attribute (e.g. an ID-only summary).
+		"""
+		if self.shard_attribute is None:
+			return None
+		value = getattr(entity, self.shard_attribute, None)
+		if value is None:
+			return None
+		return _UNSAFE_SHARD_CHARACTERS.sub('_', str(value))
+
+	def get_config_filename(self, shard=None):
+		extension = '.tf.json' if self.output_format == JSON_FORMAT else '.tf'
+		if shard is None:
+			return self.resource_type + extension
+		return f'{self.resource_type}.{shard}{extension}'
+
+	def get_config_filenames(self):
+		"""
+		Returns the existing configuration files of the resource type, in either layout and format.
+		"""
+		filenames = [self.resource_type + extension for extension in ('.tf', '.tf.json')
+			if os.path.exists(self.resource_type + extension)]
+		for extension in ('.tf', '.tf.json'):
+			filenames.extend(sorted(glob.glob(glob.escape(self.resource_type) + '.*' + extension)))
+		return filenames
+
+	def get_entity_config_filename(self, entity):
+		return self.get_config_filename(self.get_shard(entity) if self.shard_files else None)
+
+	def remove_stale_config(self, written):
+		"""
+		Remove configuration files of the resource type that were not just written, left
+		over from shards that are gone or from the other layout, so no resource is declared twice.
+		"""
+		for filename in self.get_config_filenames():
+			if filename not in written:
+				logging.info(f'Removing {filename}, its resources moved to other files')
+				os.remove(filename)
+
+	def render_entity(self, entity):
+		"""
+		Returns the HCL resource block for one entity.
 		Override this method in child classes to provide the query for specific resource type.
 		"""
 		raise NotImplementedError
 
-	def create_terraform_config(self):
+	def entity_config(self, entity):
 		"""
-		Create the Terraform configuration for the fetched resource.
-		Override this method in child classes to provide the query for specific resource type.
+		Returns the arguments and blocks of one entity's resource as the dict written to .tf.json.
+		Override this method in child classes, like render_entity.
 		"""
 		raise NotImplementedError
 
-	def import_to_terraform(self, resources):
+	def render_block(self, entity, output_format=None):
 		"""
-		Import resrouces into Terraform
+		Returns the configuration of one entity in the handler's output format, unless
+		another one is given: an HCL resource block, or the member of the resource
+		object in a .tf.json file.
+		"""
+		if (output_format or self.output_format) == JSON_FORMAT:
+			return render_member(self.get_resource_name(entity), self.entity_config(entity))
+		return self.render_entity(entity)
+
+	def write_config_blocks(self, tf_file, blocks, chunk_size=WRITE_CHUNK_SIZE, output_format=None):
+		"""
+		Write blocks from render_block as a complete configuration file, in the handler's
+		output format unless another one is given. Returns the number of blocks written.
 		"""
+		if (output_format or self.output_format) != JSON_FORMAT:
+			return write_blocks(tf_file, blocks, chunk_size)
+		tf_file.write(json_header(self.resource_type))
+		count = write_blocks(tf_file, blocks, chunk_size, MEMBER_SEPARATOR)
+		tf_file.write(JSON_FOOTER)
+		return count
+
+	def get_resource_name(self, entity):
+		return self.name_allocator.allocate(self.resource_type, entity.id, entity.name)
+
+	def get_reference_address(self, resource_type, resource_id):
+		"""
+		Returns the address of the referenced resource when it is rendered in the same
+		run, so the reference can be written as <address>.id instead of a literal ID.
+		"""
+		if self.address_index is None:
+			return None
+		return self.address_index.get(resource_type, resource_id)
+
+	def create_terraform_config(self, entities, filename=None):
+		"""
+		Create the Terraform configuration for the fetched resource.
+		`entities` can be any iterable, configuration is written as entities arrive.
+		Written to get_config_filename() unless another filename is given, or with
+		shard_files to one file per shard once all entities arrived.
+		With render_workers set, all entities are collected first and chunks of them are
+		rendered in worker processes, written in their original order: the file is the
+		same as when rendered here.
+		"""
+		# Entities may still be arriving from NerdGraph, only the rendering itself is timed
+		render_seconds = 0.0
+		count = 0
+		pool = None
+		def render(entity):
+			nonlocal render_seconds
+			start = time.perf_counter()
+			block = self.render_block(entity)
+			render_seconds += time.perf_counter() - start
+			return block
+
+		def render_in_workers(indices):
+			# Summed over the workers, the rendering's CPU time rather than its wall time
+			nonlocal render_seconds, count
+			for text, chunk_count, seconds in pool.render(indices):
+				count += chunk_count
+				render_seconds += seconds
+				yield text
+
+		def write(filename, entities):
+			# Entities may still be streaming from NerdGraph, the existing file is only replaced
+			# once all of them are rendered, a failed fetch must not leave it truncated.
+			# With a pool, `entities` are the indices of the entities it renders
+			nonlocal count
+			tmp_filename = filename + '.tmp'
+			try:
+				with open(tmp_filename, 'w') as tf_file:
+					if pool is None:
+						count += self.write_config_blocks(tf_file, map(render, entities))
+					else:
+						self.write_config_blocks(tf_file, render_in_workers(entities), chunk_size=1)
+				os.replace(tmp_filename, filename)
+			except BaseException:
+				if os.path.exists(tmp_filename):
+					os.remove(tmp_filename)
+				raise
+
+		with span('write_config', resource_type=self.resource_type):
+			if self.render_workers > 1 and fork_available():
+				entities = list(entities)
+				pool = RenderPool(self, entities, self.render_workers)
+			elif self.render_workers > 1:
+				logging.warning(f'Rendering {self.resource_type} in this process, render workers need the fork start method')
+			try:
+				if filename is not None or not self.shard_files or self.shard_attribute is None:
+					write(filename or self.get_config_filename(), entities if pool is None else range(len(entities)))
+					if filename is None:
+						self.remove_stale_config({self.get_config_filename()})
+				else:
+					shards = {}
+					for index, entity in enumerate(entities):
+						shards.setdefault(self.get_entity_config_filename(entity), []).append(entity if pool is None else index)
+					for shard_filename, shard_entities in shards.items():
+						write(shard_filename, shard_entities)
+					self.remove_stale_config(shards)
+					logging.info(f"Sharded {self.resource_type} configuration by {self.shard_attribute} into {len(shards)} files")
+			finally:
+				if pool is not None:
+					pool.close()
+		metrics.observe('render', render_seconds, resource_type=self.resource_type)
+		increment('entities_rendered', count, resource_type=self.resource_type)
+		logging.info(f"Created initial configuration for {count} {self.resource_type} resources")
+
+	def parse_entity(self, data):
+		"""
+		Parse one NerdGraph entity into the handler's model, failing with a ModelError
+		when the response does not have the expected shape.
+		"""
+		return parse_entity(EntitySummary if self.field_set == SUMMARY_FIELDS else self.model, data)
+
+	def get_import_id(self, resource):
+		"""
+		Returns the ID terraform expects when importing the resource.
+		Override this method in child classes whose import ID is a composite key.
+		"""
+		return resource.id
+
+	def get_resource_address(self, resource):
+		"""
+		Returns the terraform address the resource is rendered and imported under.
+		"""
+		return f"{self.resource_type}.{self.get_resource_name(resource)}"
+
+	def filter_unmanaged(self, resources, state_index):
+		"""
+		Returns (resources not yet in the terraform state, number of resources skipped).
+		"""
+		if state_index is None:
+			return list(resources), 0
+		to_import = []
+		skipped = 0
 		for resource in resources:
-			if self.resource_type == 'newrelic_nrql_alert_condition':
-				resource_id = resource['policyId'] + ':' + resource['id']
+			if state_index.contains(self.resource_type, self.get_import_id(resource), self.get_resource_address(resource)):
+				skipped += 1
 			else:
-				resource_id = resource['id']
-			unique_resource_name = modify_name(resource['name'], resource['id'])
-			logging.info(f"Importing {self.resource_type} with ID: {resource_id}")
-			try:
-				subprocess.run(['terraform', 'import', f'{self.resource_type}.{unique_resource_name}', resource_id], check=True)
-			except subprocess.CalledProcessError as e:
-				logging.error(f"Error importing resource ID {resource_id}: {e}")
+				to_import.append(resource)
+		increment('entities_skipped_in_state', skipped, resource_type=self.resource_type)
+		return to_import, skipped
+
+	def import_to_terraform(self, resources, on_imported=None):
+		"""
+		Import resrouces into Terraform
+		on_imported is called with every resource as soon as it was imported.
+		With import_concurrency, several terraform processes run at a time, as many as
+		the controller allows given how long the imports take and how many fail.
+		Returns a dict of failed resource address -> error message.
+		"""
+		if self.import_concurrency is None or self.import_concurrency.maximum <= 1:
+			results = [self.import_resource(resource, on_imported) for resource in resources]
+		else:
+			with ThreadPoolExecutor(max_workers=self.import_concurrency.maximum, thread_name_prefix='terraform-import') as executor:
+				results = list(executor.map(lambda resource: self.import_resource(resource, on_imported), resources))
+		failures = {address: error for address, error in results if error is not None}
+		increment('import_failures', len(failures), resource_type=self.resource_type)
+		return failures
+
+	def import_resource(self, resource, on_imported=None):
+		"""
+		Import one resource with `terraform import`. Returns its address and the error, or None.
+		"""
+		resource_id = self.get_import_id(resource)
+		address = self.get_resource_address(resource)
+		logging.info(f"Importing {self.resource_type} with ID: {resource_id}")
+		try:
+			with self.import_concurrency.slot() if self.import_concurrency is not None else nullcontext():
+				with span('terraform_import', resource_type=self.resource_type):
+					subprocess.run(['terraform', 'import', LOCK_TIMEOUT, address, resource_id], check=True)
+		except subprocess.CalledProcessError as e:
+			logging.error(f"Error importing resource ID {resource_id}: {e}")
+			return address, str(e)
+		if on_imported is not None:
+			on_imported(resource)
+		return address, None
+
+	def write_import_blocks(self, resources):
+		"""
+		Write a terraform import block for every resource next to the generated config.
+		Returns the file name and a list of (first_line, last_line, address) spans so
+		diagnostics pointing into the file can be traced back to a resource.
+		"""
+		filename = self.resource_type + '_imports.tf'
+		spans = []
+		line = 1
+		with open(filename, 'w') as tf_file:
+			for resource in resources:
+				address = self.get_resource_address(resource)
+				tf_file.write(f'import {{\n  to = {address}\n  id = "{self.get_import_id(resource)}"\n}}\n\n')
+				spans.append((line, line + 3, address))
+				line += 5
+		return filename, spans
+
+	def bulk_import_to_terraform(self, resources, on_imported=None, target=False):
+		"""
+		Import resources with a single terraform plan/apply driven by import blocks
+		instead of one `terraform import` process per resource.
+		Resources whose import fails during the plan, or whose plan would do more than
+		import them, are reported and sent through import_to_terraform instead.
+		With target the plan is limited to these resources (and what they reference),
+		for when configuration of other resource types is still being imported.
+		on_imported is called with every resource that was imported.
+		Returns a dict of failed resource address -> error message.
+		"""
+		resources = list(resources)
+		if not resources:
+			return {}
+		with BULK_IMPORT_LOCK:
+			return self._bulk_import(resources, on_imported, target)
+
+	def _bulk_import(self, resources, on_imported, target):
+		resources_by_address = {self.get_resource_address(resource): resource for resource in resources}
+		import_file, spans = self.write_import_blocks(resources)
+		plan_file = self.resource_type + '.tfplan'
+
+		try:
+			logging.info(f"Planning import of {len(resources)} {self.resource_type} resources from {import_file}")
+			with span('terraform_plan', resource_type=self.resource_type):
+				targets = [f'-target={address}' for address in resources_by_address] if target else []
+				plan = subprocess.run(['terraform', 'plan', '-json', '-input=false', LOCK_TIMEOUT, f'-out={plan_file}'] + targets,
+					capture_output=True, text=True)
+			failures, unattributed, changes = parse_terraform_json_output(plan.stdout, import_file, spans)
+			blocked = {address: f'plan would {action} this resource' for address, action in changes.items()
+				if action not in ('import', 'noop', 'read')}
+
+			if plan.returncode == 0 and not failures and not blocked:
+				logging.info(f"Applying {plan_file}")
+				with span('terraform_apply', resource_type=self.resource_type):
+					apply = subprocess.run(['terraform', 'apply', '-json', '-input=false', LOCK_TIMEOUT, plan_file], capture_output=True, text=True)
+				failures, unattributed, _ = parse_terraform_json_output(apply.stdout, import_file, spans)
+				for message in unattributed:
+					logging.error(f"Error applying {plan_file}: {message}")
+				if apply.returncode != 0 and not failures and not unattributed:
+					logging.error(f"Error applying {plan_file}: {apply.stderr.strip()}")
+				for address, message in failures.items():
+					logging.error(f"Error importing {address}: {message}")
+				increment('import_failures', len(failures), resource_type=self.resource_type)
+				# A failed apply may have stopped anywhere, the state check finds what it did import
+				if on_imported is not None and apply.returncode == 0:
+					for address, resource in resources_by_address.items():
+						if address not in failures:
+							on_imported(resource)
+				return failures
+
+			for message in unattributed:
+				logging.error(f"Error planning bulk import: {message}")
+			if plan.returncode != 0 and not failures and not unattributed:
+				logging.error(f"Error planning bulk import: {plan.stderr.strip()}")
+			failures.update(blocked)
+			for address, message in failures.items():
+				logging.error(f"Error importing {address}: {message}")
+			increment('import_failures', len(failures), resource_type=self.resource_type)
+		finally:
+			# Left behind, the import blocks would be planned again by every later terraform plan of the directory
+			for filename in (import_file, plan_file):
+				if os.path.exists(filename):
+					os.remove(filename)
+
+		# The single run could not be applied, import whatever did not fail one by one
+		remaining = [resource for address, resource in resources_by_address.items() if address not in failures]
+		if remaining:
+			logging.warning(f"Falling back to per-resource import for {len(remaining)} resources")
+			failures.update(self.import_to_terraform(remaining, on_imported))
+		return failures
+
+
+def parse_terraform_json_output(output, import_file, spans):
+	"""
+	Parse the machine readable (-json) output of terraform plan/apply.
+	Returns (failures, unattributed, changes) where failures maps a resource address
+	to its error, unattributed lists errors that could not be tied to a resource and
+	changes maps a resource address to its planned action.
+	"""
+	failures = {}
+	unattributed = []
+	changes = {}
+	for line in output.splitlines():
+		try:
+			message = json.loads(line)
+		except ValueError:
+			continue
+		if message.get('type') == 'planned_change':
+			change = message['change']
+			changes[change['resource']['addr']] = change['action']
+		elif message.get('type') == 'apply_errored':
+			failures[message['hook']['resource']['addr']] = message.get('@message', 'apply failed')
+		elif message.get('type') == 'diagnostic' and message['diagnostic'].get('severity') == 'error':
+			diagnostic = message['diagnostic']
+			error = diagnostic.get('summary', '')
+			if diagnostic.get('detail'):
+				error += ': ' + diagnostic['detail']
+			address = diagnostic.get('address') or _address_at(diagnostic.get('range'), import_file, spans)
+			if address:
+				failures[address] = error
+			else:
+				unattributed.append(error)
+	return failures, unattributed, changes
+
 
+def _address_at(source_range, import_file, spans):
+	# Maps a diagnostic's source range inside the import file back to the block's address
+	if not source_range or source_range.get('filename') != import_file:
+		return None
+	line = source_range['start']['line']
+	for first, last, address in spans:
+		if first <= line <= last:
+			return address
+	return None
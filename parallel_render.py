@@ -0,0 +1,68 @@
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from hcl_renderer import WRITE_CHUNK_SIZE
+
+
+# The handler and entities the worker processes render, set before the workers are forked
+# so they inherit them instead of having them pickled and sent chunk by chunk
+_handler = None
+_entities = None
+
+
+def fork_available():
+	return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def _render_chunk(indices):
+	start = time.perf_counter()
+	entities = _entities
+	text = _handler.block_separator.join(_handler.render_block(entities[index]) for index in indices)
+	return text, len(indices), time.perf_counter() - start
+
+
+class RenderPool:
+	"""
+	Worker processes rendering entities with resource_handler.render_block. The workers
+	are forked once the entities are in memory and their names allocated, a task is only
+	a range or list of indices into `entities` and its result the rendered text. One
+	pool serves all the files of a handler, e.g. every shard file.
+	Requires the fork start method, see fork_available().
+	"""
+	def __init__(self, resource_handler, entities, workers):
+		global _handler, _entities
+		# Names are allocated here, in the order of `entities`, the workers only look them up
+		for entity in entities:
+			resource_handler.get_resource_name(entity)
+		_handler = resource_handler
+		_entities = entities
+		self.workers = workers
+		self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def close(self):
+		global _handler, _entities
+		self.executor.shutdown(cancel_futures=True)
+		_handler = None
+		_entities = None
+
+	def render(self, indices, chunk_size=WRITE_CHUNK_SIZE):
+		"""
+		Render the entities at `indices`, chunk_size per task. Yields (text, entities,
+		render_seconds) for every chunk in the order of `indices`, so joining the texts
+		gives exactly the output of rendering them one by one. At most two chunks per
+		worker are in flight, the rendered configuration is never held in memory as a whole.
+		"""
+		pending = deque()
+		for start in range(0, len(indices), chunk_size):
+			pending.append(self.executor.submit(_render_chunk, indices[start:start + chunk_size]))
+			if len(pending) >= self.workers * 2:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
@@ -0,0 +1,48 @@
+import queue
+import threading
+
+
+_DONE = object()
+
+
+def prefetch(iterable, maxsize=4):
+	"""
+	Iterate over `iterable` in a background thread while the caller consumes it.
+	At most `maxsize` items are buffered ahead of the consumer, so a fast producer
+	(page downloads) can not run away from a slow consumer (rendering) and vice versa.
+	Exceptions raised by the producer are re-raised in the consumer. Closing the
+	returned generator stops the producer after its current item.
+	"""
+	buffer = queue.Queue(maxsize)
+	stop = threading.Event()
+
+	def put(item):
+		while not stop.is_set():
+			try:
+				buffer.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def produce():
+		try:
+			for item in iterable:
+				if not put((item, None)):
+					return
+			put((_DONE, None))
+		except BaseException as e:
+			put((_DONE, e))
+
+	thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+	thread.start()
+	try:
+		while True:
+			item, error = buffer.get()
+			if item is _DONE:
+				if error is not None:
+					raise error
+				return
+			yield item
+	finally:
+		stop.set()
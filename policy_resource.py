@@ -0,0 +1,22 @@
+from newrelic_resource import NewRelicResource
+from hcl_renderer import render_policy
+from json_renderer import policy_config
+from models import Policy
+
+
+class PolicyResource(NewRelicResource):
+	model = Policy
+
+	search_path = ('alerts', 'policiesSearch')
+	entities_field = 'policies'
+	fields = [
+		'id',
+		'name',
+		'incidentPreference'
+	]
+
+	def render_entity(self, entity):
+		return render_policy(entity, self.get_resource_name(entity))
+
+	def entity_config(self, entity):
+		return policy_config(entity)
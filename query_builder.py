@@ -0,0 +1,56 @@
+import json
+
+
+# Field sets a handler can be asked to fetch
+FULL_FIELDS = 'full'
+SUMMARY_FIELDS = 'summary'
+FIELD_SETS = (FULL_FIELDS, SUMMARY_FIELDS)
+
+INDENT = '  '
+
+
+def render_selection(fields, depth):
+	"""
+	Render a field schema as a GraphQL selection set. A schema is a list of field
+	names and (name, subfields) pairs, the name may also be an inline fragment
+	such as '... on AiNotificationsTokenAuth'.
+	"""
+	lines = []
+	for field in fields:
+		if isinstance(field, tuple):
+			name, subfields = field
+			lines.append(f'{INDENT * depth}{name} {{')
+			lines.extend(render_selection(subfields, depth + 1))
+			lines.append(f'{INDENT * depth}}}')
+		else:
+			lines.append(f'{INDENT * depth}{field}')
+	return lines
+
+
+def render_value(value):
+	"""
+	Render a Python value as a GraphQL literal, dicts become input objects.
+	"""
+	if isinstance(value, dict):
+		return '{' + ', '.join(f'{name}: {render_value(item)}' for name, item in value.items()) + '}'
+	return json.dumps(value)
+
+
+def build_search_query(account_id, search_path, entities_field, fields, cursor=None, arguments=None):
+	"""
+	Build the query for one page of a cursor paginated search inside an account.
+	search_path leads from the account to the search field, whose entities_field
+	lists the entities. arguments (e.g. searchCriteria) are passed to the search
+	field next to the cursor. The first page is requested without a cursor.
+	"""
+	arguments = dict(arguments or {})
+	if cursor is not None:
+		arguments['cursor'] = cursor
+	*parents, search_field = search_path
+	if arguments:
+		search_field += '(' + ', '.join(f'{name}: {render_value(value)}' for name, value in arguments.items()) + ')'
+
+	selection = [(entities_field, fields), 'nextCursor']
+	for name in reversed([f'account(id: {account_id})'] + parents + [search_field]):
+		selection = [(name, selection)]
+	return '\n'.join(['{'] + render_selection([('actor', selection)], 1) + ['}']) + '\n'
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from nerdgraph_client import NerdGraphError
+
+
+DEFAULT_CACHE_DIR = '.nerdgraph_cache'
+
+
+class CacheMissError(NerdGraphError):
+	"""
+	Raised in offline mode when a response was never cached.
+	"""
+
+
+class ResponseCache:
+	"""
+	Content addressed on-disk cache of NerdGraph responses, keyed by account, query text and cursor.
+	Entries expire after `ttl` seconds and the least recently used ones are evicted once the
+	cache grows beyond `max_bytes`. In offline mode expired entries are still served and a
+	miss raises CacheMissError instead of going to the network.
+	"""
+	def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=24 * 60 * 60, max_bytes=1024 * 1024 * 1024, offline=False):
+		self.directory = directory
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self.offline = offline
+		os.makedirs(directory, exist_ok=True)
+		self.size = sum(os.path.getsize(path) for path in self._entries())
+
+	def key(self, account_id, query, cursor):
+		payload = json.dumps([str(account_id), ' '.join(query.split()), cursor])
+		return hashlib.sha256(payload.encode()).hexdigest()
+
+	def path(self, key):
+		return os.path.join(self.directory, key[:2], key + '.json')
+
+	def get(self, key):
+		"""
+		Returns the cached response for key, or None when it is missing or expired.
+		"""
+		path = self.path(key)
+		try:
+			modified = os.path.getmtime(path)
+			if not self.offline and time.time() - modified > self.ttl:
+				self._remove(path)
+				return None
+			with open(path) as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			if self.offline:
+				raise CacheMissError(f'No cached NerdGraph response for key {key}, run once without --offline first')
+			return None
+		# Bump the access time so eviction drops the least recently used entries first
+		os.utime(path, (time.time(), modified))
+		return data
+
+	def put(self, key, data):
+		path = self.path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		previous = os.path.getsize(path) if os.path.exists(path) else 0
+		fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+		with os.fdopen(fd, 'w') as f:
+			json.dump(data, f, separators=(',', ':'))
+		os.replace(tmp_path, path)
+		self.size += os.path.getsize(path) - previous
+		if self.size > self.max_bytes:
+			self.evict()
+
+	def evict(self):
+		"""
+		Remove least recently used entries until the cache is at most 90% of max_bytes.
+		"""
+		target = self.max_bytes * 0.9
+		entries = sorted(self._entries(), key=os.path.getatime)
+		for path in entries:
+			if self.size <= target:
+				break
+			self._remove(path)
+		logging.info(f'Evicted NerdGraph cache entries, {self.size} bytes remaining')
+
+	def _remove(self, path):
+		try:
+			size = os.path.getsize(path)
+			os.remove(path)
+			self.size -= size
+		except OSError:
+			pass
+
+	def _entries(self):
+		for root, _, files in os.walk(self.directory):
+			for name in files:
+				if name.endswith('.json'):
+					yield os.path.join(root, name)
@@ -0,0 +1,217 @@
+import gzip
+import hashlib
+import json
+import logging
+import mmap
+import os
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+# Entities per independently compressed block, a lookup decompresses one block
+BLOCK_SIZE = 1000
+
+
+def compression_available(compression):
+	return compression != 'zstd' or zstandard is not None
+
+
+def snapshot_filename(base, compression='none'):
+	return base + '.ndjson' + EXTENSIONS[compression]
+
+
+def index_filename(filename):
+	return filename + '.idx'
+
+
+def _compress(data, compression):
+	if compression == 'gzip':
+		return gzip.compress(data, mtime=0)
+	return zstandard.ZstdCompressor().compress(data)
+
+
+def _decompress(data, compression):
+	if compression == 'gzip':
+		return gzip.decompress(data)
+	return zstandard.ZstdDecompressor().decompress(data)
+
+
+class SnapshotWriter:
+	"""
+	Writes a snapshot one entity at a time as NDJSON, one compact, key sorted JSON
+	object per line, so the whole list is never serialized at once. Compressed
+	snapshots are written as concatenated gzip members or zstd frames of BLOCK_SIZE
+	entities each. Next to the data an index maps every entity ID to its block, its
+	position in the block and the hash of its line. Nothing replaces the previous
+	snapshot until commit().
+	"""
+	def __init__(self, base, compression='none', block_size=BLOCK_SIZE):
+		if not compression_available(compression):
+			raise ValueError('zstd compression needs the zstandard package: pip install zstandard')
+		self.base = base
+		self.compression = compression
+		self.filename = snapshot_filename(base, compression)
+		self.block_size = block_size
+		self.file = open(self.filename + '.tmp', 'wb')
+		self.blocks = []
+		self.entities = {}
+		# Uncompressed lines of the block being filled and their total size
+		self.block = []
+		self.block_bytes = 0
+		self.offset = 0
+
+	def write(self, entity):
+		data = entity if isinstance(entity, dict) else entity.to_dict()
+		# The same serialization incremental.entity_hash uses, so the hash can be compared directly
+		line = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+		entity_hash = hashlib.sha256(line).hexdigest()
+		if self.compression == 'none':
+			self.entities[data['id']] = [0, self.offset, len(line), entity_hash]
+			self.file.write(line + b'\n')
+			self.offset += len(line) + 1
+			return
+		self.entities[data['id']] = [len(self.blocks), self.block_bytes, len(line), entity_hash]
+		self.block.append(line + b'\n')
+		self.block_bytes += len(line) + 1
+		if len(self.block) >= self.block_size:
+			self.flush_block()
+
+	def flush_block(self):
+		if not self.block:
+			return
+		compressed = _compress(b''.join(self.block), self.compression)
+		self.blocks.append([self.offset, len(compressed)])
+		self.file.write(compressed)
+		self.offset += len(compressed)
+		self.block = []
+		self.block_bytes = 0
+
+	def commit(self):
+		"""
+		Finish the snapshot and move it and its index in place of the previous one.
+		"""
+		if self.compression == 'none':
+			self.blocks = [[0, self.offset]]
+		else:
+			self.flush_block()
+		self.file.close()
+		index = {'compression': self.compression, 'size': self.offset, 'blocks': self.blocks, 'entities': self.entities}
+		with open(index_filename(self.filename) + '.tmp', 'w') as f:
+			json.dump(index, f, separators=(',', ':'))
+		os.replace(self.filename + '.tmp', self.filename)
+		os.replace(index_filename(self.filename) + '.tmp', index_filename(self.filename))
+		# A snapshot written with another compression would otherwise be found by later runs
+		for compression in COMPRESSIONS:
+			other = snapshot_filename(self.base, compression)
+			if other != self.filename:
+				for filename in (other, index_filename(other)):
+					if os.path.exists(filename):
+						os.remove(filename)
+
+	def abort(self):
+		self.file.close()
+		os.remove(self.filename + '.tmp')
+
+
+class Snapshot:
+	"""
+	Read access to a snapshot written by SnapshotWriter. Only the index is loaded,
+	entities are read from a memory map of the data file when they are asked for.
+	"""
+	def __init__(self, filename, index):
+		self.filename = filename
+		self.compression = index['compression']
+		self.blocks = index['blocks']
+		self.entities = index['entities']
+		self.file = open(filename, 'rb')
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if index['size'] else b''
+		self.block_cache = (None, None)
+
+	def __len__(self):
+		return len(self.entities)
+
+	def __contains__(self, entity_id):
+		return entity_id in self.entities
+
+	def ids(self):
+		return self.entities.keys()
+
+	def hash(self, entity_id):
+		return self.entities[entity_id][3]
+
+	def read_block(self, number):
+		if self.block_cache[0] != number:
+			offset, length = self.blocks[number]
+			data = self.map[offset:offset + length]
+			if self.compression != 'none':
+				data = _decompress(data, self.compression)
+			self.block_cache = (number, data)
+		return self.block_cache[1]
+
+	def get(self, entity_id):
+		"""
+		Returns the entity as the dict it was written from, or None when it is not in the snapshot.
+		"""
+		entry = self.entities.get(entity_id)
+		if entry is None:
+			return None
+		block, offset, length, _ = entry
+		if self.compression == 'none':
+			return json.loads(self.map[offset:offset + length])
+		return json.loads(self.read_block(block)[offset:offset + length])
+
+	def __iter__(self):
+		"""
+		Yields every entity in the order it was written, one block in memory at a time.
+		"""
+		if not self.entities:
+			return
+		if self.compression == 'none':
+			self.map.seek(0)
+			for line in iter(self.map.readline, b''):
+				yield json.loads(line)
+			return
+		for number in range(len(self.blocks)):
+			for line in self.read_block(number).splitlines():
+				yield json.loads(line)
+
+	def close(self):
+		if self.map:
+			self.map.close()
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+def open_snapshot(base):
+	"""
+	Open the snapshot written for `base` with any compression. Returns None when there
+	is none, or when its index is missing or does not match the data.
+	"""
+	for compression in COMPRESSIONS:
+		filename = snapshot_filename(base, compression)
+		if not os.path.exists(filename):
+			continue
+		try:
+			with open(index_filename(filename)) as f:
+				index = json.load(f)
+		except (OSError, ValueError) as e:
+			logging.warning(f'Ignoring snapshot {filename} without a readable index: {e}')
+			return None
+		if index.get('size') != os.path.getsize(filename):
+			logging.warning(f'Ignoring snapshot {filename}, it does not match its index')
+			return None
+		if not compression_available(index['compression']):
+			logging.warning(f'Ignoring snapshot {filename}, reading it needs the zstandard package')
+			return None
+		return Snapshot(filename, index)
+	return None
@@ -0,0 +1,67 @@
+import json
+import logging
+import subprocess
+from collections import defaultdict
+
+
+class StateIndex:
+	"""
+	Index of the resources already managed in the Terraform state, by resource type.
+	A resource counts as managed when either its import ID or its address is present.
+	"""
+	def __init__(self):
+		self.ids = defaultdict(set)
+		self.addresses = set()
+
+	def add(self, resource_type, address, resource_id):
+		self.addresses.add(address)
+		if resource_id is not None:
+			self.ids[resource_type].add(str(resource_id))
+
+	def contains(self, resource_type, import_id, address):
+		return import_id in self.ids.get(resource_type, ()) or address in self.addresses
+
+	def __len__(self):
+		return len(self.addresses)
+
+
+def load_state_index(state_file=None):
+	"""
+	Build a StateIndex from `terraform show -json`, or from a state file when one is given
+	or terraform can not be run. Returns an empty index when there is no state yet.
+	"""
+	index = StateIndex()
+	if state_file is None:
+		try:
+			result = subprocess.run(['terraform', 'show', '-json'], capture_output=True, text=True, check=True)
+			_index_show_module(index, json.loads(result.stdout or '{}').get('values', {}).get('root_module', {}))
+			logging.info(f'Found {len(index)} resources in the terraform state')
+			return index
+		except (OSError, subprocess.CalledProcessError, ValueError) as e:
+			logging.warning(f'Could not read state with terraform show, trying terraform.tfstate: {e}')
+			state_file = 'terraform.tfstate'
+
+	try:
+		with open(state_file) as f:
+			state = json.load(f)
+	except FileNotFoundError:
+		return index
+	for resource in state.get('resources', []):
+		if resource.get('mode') != 'managed':
+			continue
+		prefix = resource['module'] + '.' if resource.get('module') else ''
+		for instance in resource.get('instances', []):
+			address = f"{prefix}{resource['type']}.{resource['name']}"
+			if 'index_key' in instance:
+				address += f"[{json.dumps(instance['index_key'])}]"
+			index.add(resource['type'], address, instance.get('attributes', {}).get('id'))
+	logging.info(f'Found {len(index)} resources in {state_file}')
+	return index
+
+
+def _index_show_module(index, module):
+	for resource in module.get('resources', []):
+		if resource.get('mode') == 'managed':
+			index.add(resource['type'], resource['address'], resource.get('values', {}).get('id'))
+	for child in module.get('child_modules', []):
+		_index_show_module(index, child)
@@ -1,23 +1,46 @@
+import logging
+import os
 import re
+import shutil
+import subprocess
+from contextlib import contextmanager
+
+
+# Runs of characters not allowed in a Terraform identifier, and of underscores, become one '_'
+_SEPARATORS = re.compile(r'[\W_]+')
+# bytes.translate is a plain table lookup, several times faster for the common ASCII name:
+# letters are lowercased, digits kept and everything else becomes '_'
+_ASCII_TRANSLATION = bytes(character + 32 if 65 <= character <= 90 else character
+	if 97 <= character <= 122 or 48 <= character <= 57 else 95 for character in range(256))
 
 
 def modify_name(name, id):
-	# Modifies resource names to fit Terraform naming convention
-	special_characters_to_remove = ['-', '+', '/', '<', '>', '@', '.', '(', ')', ' ', '&', ':', '=', '%', "'", '"', ',']
-	for char in special_characters_to_remove:
-		name = name.replace(char, '_')
-	modified_name = 'terraform_' + name + '_' + id
-	while '__' in modified_name:
-		modified_name = modified_name.replace('__', '_')
-	return modified_name.lower()
-
-def sanitize_string(input_string):
-	query = input_string.strip()
-	query = query.replace('\r\n', ' ')
-	query = query.replace('\n', ' ')
-	if '"' in query:
-		query = query.replace('"', '\\"')
-	elif '\\' in query:
-		query = query.replace('\\', '\\\\')
-	return query
+	# Modifies resource names to fit Terraform naming convention, see name_allocator.py for unique names
+	if name.isascii():
+		name = '_'.join(filter(None, name.encode().translate(_ASCII_TRANSLATION).decode().split('_')))
+	else:
+		name = _SEPARATORS.sub('_', name.lower()).strip('_')
+	return ('terraform_' + name + '_' if name else 'terraform_') + id.lower()
+
+
+@contextmanager
+def working_directory(path):
+	# Run the enclosed block in `path`, creating it when needed
+	os.makedirs(path, exist_ok=True)
+	previous = os.getcwd()
+	os.chdir(path)
+	try:
+		yield
+	finally:
+		os.chdir(previous)
+
 
+def prepare_root_module(directory, providers_file, init=True):
+	# A shard or fleet account directory is a root module of its own, it needs the provider configuration and terraform init
+	if os.path.exists(providers_file) and not os.path.exists(os.path.join(directory, 'providers.tf')):
+		shutil.copyfile(providers_file, os.path.join(directory, 'providers.tf'))
+	if init and not os.path.isdir(os.path.join(directory, '.terraform')):
+		logging.info(f'Running terraform init in {directory}')
+		result = subprocess.run(['terraform', 'init', '-input=false'], cwd=directory, capture_output=True, text=True)
+		if result.returncode != 0:
+			logging.warning(f'terraform init failed in {directory}: {result.stderr.strip()}')